@@ -0,0 +1,306 @@
+from array import array
+import ijson
+import numpy as np
+import pandas as pd
+from NDJSON_Decoding import iter_ndjson
+from NDJSON_IO import open_lines, prefetch_files
+from FHIR_Helpers import activity_sort_keys
+from FHIR_Manifest import save_state
+from FHIR_Metrics import COUNTERS
+from FHIR_Locations import NO_LOCATION, LocationTable, lookup_addresses
+
+# Sentinels for practitioners with no start / end / location yet
+NO_FIRST = 2**63 - 1
+NO_LAST = -2**63
+
+# Encounters collected before one vectorized fold into the ActivityStore
+REDUCE_CHUNK = 65_536
+
+# Compact first/last activity per practitioner.
+# Practitioner ids are interned to integer slots; per slot we keep int64 sort keys,
+# int32 codes into an interned location table, and the original timestamp strings.
+# Ties keep the entry that was seen first, so results match a single ordered scan.
+# `locations` may be the LocationTable built in STEP 3, so codes are its ids
+class ActivityStore:
+    def __init__(self, locations=None):
+        self.slots = {}
+        self.first_keys = array("q")
+        self.last_keys = array("q")
+        self.first_locations = array("i")
+        self.last_locations = array("i")
+        self.first_dates = []
+        self.last_dates = []
+        self.locations = LocationTable() if locations is None else locations
+
+    def __len__(self):
+        return len(self.slots)
+
+    # Normalized location keys, by code
+    @property
+    def location_refs(self):
+        return self.locations.keys
+
+    # Intern a normalized location ref (None -> NO_LOCATION)
+    def location_code(self, loc_ref):
+        return self.locations.intern(loc_ref)
+
+    # Intern a raw Encounter location reference (normalized once per distinct string)
+    def raw_location_code(self, ref):
+        return self.locations.intern_raw(ref)
+
+    # Intern a practitioner id to its slot, adding an empty slot for a new one
+    def slot(self, pid):
+        slot = self.slots.get(pid)
+        if slot is None:
+            slot = self.slots[pid] = len(self.first_dates)
+            self.first_keys.append(NO_FIRST)
+            self.last_keys.append(NO_LAST)
+            self.first_locations.append(NO_LOCATION)
+            self.last_locations.append(NO_LOCATION)
+            self.first_dates.append(None)
+            self.last_dates.append(None)
+        return slot
+
+    # Intern many distinct practitioner ids at once; returns their slots as an int64 array.
+    # New ids get consecutive slots, added to the arrays in bulk
+    def slots_of(self, pids):
+        slots = np.fromiter((self.slots.get(pid, -1) for pid in pids), dtype=np.int64, count=len(pids))
+        new = np.flatnonzero(slots < 0)
+        if len(new):
+            slots[new] = np.arange(len(self.first_dates), len(self.first_dates) + len(new))
+            self.slots.update(zip([pids[i] for i in new.tolist()], slots[new].tolist()))
+            self.first_keys.extend(array("q", [NO_FIRST]) * len(new))
+            self.last_keys.extend(array("q", [NO_LAST]) * len(new))
+            self.first_locations.extend(array("i", [NO_LOCATION]) * len(new))
+            self.last_locations.extend(array("i", [NO_LOCATION]) * len(new))
+            self.first_dates.extend([None] * len(new))
+            self.last_dates.extend([None] * len(new))
+        return slots
+
+    # Fold one period into a practitioner's first/last activity
+    def update(self, pid, start, start_key, start_location, end, end_key, end_location):
+        slot = self.slot(pid)
+
+        # Update first activity
+        if start and start_key < self.first_keys[slot]:
+            self.first_keys[slot] = start_key
+            self.first_locations[slot] = start_location
+            self.first_dates[slot] = start
+
+        # Update last activity
+        if end and end_key > self.last_keys[slot]:
+            self.last_keys[slot] = end_key
+            self.last_locations[slot] = end_location
+            self.last_dates[slot] = end
+
+    # Fold many participations at once, given as arrays in the order they were seen:
+    # slots (from slots_of()), the start/end strings, their sort keys (NO_FIRST / NO_LAST when
+    # missing) and location codes (end_locations, when the end has its own). Per practitioner
+    # the smallest start and largest end win, ties going to the row seen first, exactly as
+    # repeated update() calls would
+    def update_many(self, slots, starts, start_keys, ends, end_keys, locations, end_locations=None):
+        for keys, dates, locations, store_keys, store_locations, store_dates, earlier in (
+            (start_keys, starts, locations,
+             self.first_keys, self.first_locations, self.first_dates, np.less),
+            (end_keys, ends, locations if end_locations is None else end_locations,
+             self.last_keys, self.last_locations, self.last_dates, np.greater)
+        ):
+            # Stable sort on (slot, key), descending keys for the last activity (~ rather than
+            # negation, which overflows on NO_LAST): each slot's winner is the first of its group
+            order = np.lexsort((keys if earlier is np.less else ~keys, slots))
+            group_start = np.empty(len(order), dtype=bool)
+            group_start[:1] = True
+            np.not_equal(slots[order[1:]], slots[order[:-1]], out=group_start[1:])
+            winners = order[group_start]
+
+            # Fold the winners in where they beat what the store already holds
+            current = np.frombuffer(store_keys, dtype=np.int64)
+            winners = winners[earlier(keys[winners], current[slots[winners]])]
+            current[slots[winners]] = keys[winners]
+            np.frombuffer(store_locations, dtype=np.int32)[slots[winners]] = locations[winners]
+            del current
+            for row, slot in zip(winners.tolist(), slots[winners].tolist()):
+                store_dates[slot] = dates[row]
+
+    # Merge a store built from later files into this one (same first/last rules), as one
+    # update_many over the other store's slots with its location codes remapped to ours
+    def merge(self, other):
+        if not len(other):
+            return self
+        # other's slots are 0..n-1 in the order its ids were added
+        slots = self.slots_of(list(other.slots))
+        codes = np.array([self.location_code(ref) for ref in other.location_refs] + [NO_LOCATION],
+                         dtype=np.int32)  # so other's NO_LOCATION (-1) maps to ours
+        self.update_many(slots,
+                         other.first_dates, np.frombuffer(other.first_keys, dtype=np.int64),
+                         other.last_dates, np.frombuffer(other.last_keys, dtype=np.int64),
+                         codes[np.frombuffer(other.first_locations, dtype=np.int32)],
+                         codes[np.frombuffer(other.last_locations, dtype=np.int32)])
+        return self
+
+# Helper: Pull (start, end, first location ref, participant refs) out of a decoded Encounter
+def encounter_fields(rec):
+    period = rec.get("period", {})
+    locations = rec.get("location", [])
+    loc_ref = next((loc.get("location", {}).get("reference") for loc in locations
+                    if loc.get("location", {}).get("reference")), None)
+    actor_refs = [participant.get("individual", {}).get("reference", "")
+                  for participant in rec.get("participant", [])]
+    return period.get("start"), period.get("end"), loc_ref, actor_refs
+
+# Helper: Same fields as encounter_fields, read straight off the ijson event stream
+# so no object tree is built for the parts of the Encounter we never look at
+def project_encounter(line):
+    start = end = loc_ref = None
+    actor_refs = []
+    for prefix, event, value in ijson.parse(line):
+        if event != "string":
+            continue
+        if prefix == "period.start":
+            start = value
+        elif prefix == "period.end":
+            end = value
+        elif prefix == "location.item.location.reference":
+            if loc_ref is None and value:
+                loc_ref = value
+        elif prefix == "participant.item.individual.reference":
+            actor_refs.append(value)
+    return start, end, loc_ref, actor_refs
+
+# Helper: Yield encounter fields from one NDJSON file, skipping corrupt lines
+# projection=True streams each line through ijson instead of decoding it fully
+def iter_encounter_fields(file, backend=None, projection=False):
+    if not projection:
+        for rec in iter_ndjson(file, backend):
+            yield encounter_fields(rec)
+        return
+
+    for line in open_lines(file):
+        try:
+            fields = project_encounter(line)
+        except (ijson.JSONError, ValueError):
+            COUNTERS["corrupt_lines"] += 1
+            print(f"⚠️ Skipping corrupt JSON in file: {file}")
+            continue
+        yield fields
+
+# Collects Encounter participations for one ActivityStore and folds them in chunks:
+# practitioner ids are interned once per distinct id, timestamps are parsed to sort keys
+# in one vectorized pass (activity_sort_keys) and the per-practitioner first/last picks
+# are numpy grouped reductions (ActivityStore.update_many)
+class ParticipationChunk:
+    def __init__(self, activity_map):
+        self.activity_map = activity_map
+        self.starts = []
+        self.ends = []
+        self.locations = []
+        self.pids = []
+        self.counts = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start, end, loc_code, pids):
+        self.starts.append(start or None)
+        self.ends.append(end or None)
+        self.locations.append(loc_code)
+        self.pids.extend(pids)
+        self.counts.append(len(pids))
+
+    def flush(self):
+        if self.pids:
+            # Row i of the chunk is a participation of Encounter encounters[i]
+            encounters = np.repeat(np.arange(len(self.counts)), self.counts)
+            pid_codes, pids = pd.factorize(np.array(self.pids, dtype=object))
+            slots = self.activity_map.slots_of(pids)[pid_codes]
+
+            # Starts and ends are parsed together, so a value used as both is parsed once
+            start_keys, end_keys = np.split(activity_sort_keys(self.starts + self.ends, NO_FIRST), 2)
+            end_keys[end_keys == NO_FIRST] = NO_LAST
+            self.activity_map.update_many(
+                slots,
+                np.array(self.starts, dtype=object)[encounters], start_keys[encounters],
+                np.array(self.ends, dtype=object)[encounters], end_keys[encounters],
+                np.array(self.locations, dtype=np.int32)[encounters]
+            )
+        self.__init__(self.activity_map)
+
+# Helper: Reduce one Encounter NDJSON file into an ActivityStore
+def reduce_encounter_file(file, activity_map=None, backend=None, projection=False):
+    if activity_map is None:
+        activity_map = ActivityStore()
+
+    chunk = ParticipationChunk(activity_map)
+    for start, end, loc_ref, actor_refs in iter_encounter_fields(file, backend, projection):
+        if not start and not end:
+            print(f"⚠️ Encounter missing period dates in file {file}")
+            continue
+
+        pids = [actor_ref.split("/")[-1] for actor_ref in actor_refs
+                if actor_ref.startswith("Practitioner/")]
+        chunk.add(start, end, activity_map.raw_location_code(loc_ref),
+                  [pid for pid in pids if pid])
+        if len(chunk) >= REDUCE_CHUNK:
+            chunk.flush()
+    chunk.flush()
+
+    return activity_map
+
+# Worker entry point: Reduce a contiguous run of Encounter files into one local store
+# (locations: a LocationTable to intern into, when run in the process that owns it)
+def reduce_encounter_files(files, backend=None, projection=False, readahead_mb=0, locations=None):
+    activity_map = ActivityStore(locations)
+    for file in prefetch_files(files, readahead_mb):
+        reduce_encounter_file(file, activity_map, backend, projection)
+    return activity_map
+
+# Worker entry point for incremental runs: reduce one file and persist its store
+# args is (file, state_file, backend, projection, readahead_mb)
+def reduce_encounter_file_to_state(args):
+    file, state_file, backend, projection, readahead_mb = args
+    save_state(reduce_encounter_files([file], backend, projection, readahead_mb), state_file)
+    return file
+
+# Activity columns added to each practitioner batch during enrichment
+ACTIVITY_COLUMNS = [
+    "first_activity_date", "first_activity_location", "first_activity_address",
+    "last_activity_date", "last_activity_location", "last_activity_address"
+]
+
+# Build the activity table once: one row per provider_id, addresses already joined in
+def activity_frame(activity_map, location_lookup):
+    # Index by location code; the trailing None is what NO_LOCATION (-1) picks up
+    locations = activity_map.locations
+    refs = locations.key_array()
+    if locations is location_lookup:
+        # The store interned into the STEP 3 table, so its codes index the addresses directly
+        addresses = locations.address_array()
+    else:
+        addresses = np.array(lookup_addresses(location_lookup, locations.keys) + [None], dtype=object)
+    first_locations = np.frombuffer(activity_map.first_locations, dtype=np.int32)
+    last_locations = np.frombuffer(activity_map.last_locations, dtype=np.int32)
+
+    frame = pd.DataFrame({
+        "first_activity_date": pd.Series(activity_map.first_dates, dtype=object),
+        "first_activity_location": refs[first_locations],
+        "first_activity_address": addresses[first_locations],
+        "last_activity_date": pd.Series(activity_map.last_dates, dtype=object),
+        "last_activity_location": refs[last_locations],
+        "last_activity_address": addresses[last_locations]
+    })
+    frame.index = pd.Index(list(activity_map.slots), name="provider_id", dtype=object)
+    return frame
+
+# Helper: Enrich one practitioner batch with a single join on provider_id
+def enrich_batch(df, activity_df):
+    enriched = df.drop(columns=ACTIVITY_COLUMNS).join(activity_df, on="provider_id")
+    return enriched[df.columns]
+
+# Helper: provider_ids whose activity columns differ between two activity tables
+# (including providers that appear in only one of them)
+def changed_providers(previous_df, activity_df):
+    previous = previous_df.reindex(activity_df.index).fillna("\0")
+    current = activity_df.fillna("\0")
+    changed = activity_df.index[(current != previous[current.columns]).any(axis=1)]
+    dropped = previous_df.index.difference(activity_df.index)
+    return set(changed).union(dropped)
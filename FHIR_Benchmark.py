@@ -0,0 +1,291 @@
+import argparse
+import json
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+import orjson
+import pandas as pd
+from NDJSON_Decoding import DECODERS, DECODE_ERRORS
+from FHIR_Helpers import normalize_location_key, activity_sort_key
+from FHIR_Activity import ActivityStore, encounter_fields
+from FHIR_Synthetic import (practitioner_record, encounter_record, location_record, write_bulk_export,
+                            write_edge_case_export)
+
+REPO_DIR = Path(__file__).resolve().parent
+
+# Which resource's records each pipeline stage is rated on (records/sec)
+STAGE_RECORDS = {"location_load": "Location", "practitioner_parse": "Practitioner",
+                 "encounter_scan": "Encounter", "merge_enrich": "Practitioner"}
+
+# Build an in-memory synthetic corpus: {resource type: [NDJSON lines as bytes]}
+def synthetic_corpus(records, seed=0):
+    rng = random.Random(seed)
+    practitioner_count = max(1, records // 10)
+    location_count = max(1, records // 100)
+    return {
+        "Location": [orjson.dumps(location_record(rng, i)) + b"\n" for i in range(records)],
+        "Practitioner": [orjson.dumps(practitioner_record(rng, i)) + b"\n" for i in range(records)],
+        "Encounter": [orjson.dumps(encounter_record(rng, i, practitioner_count, location_count)) + b"\n"
+                      for i in range(records)]
+    }
+
+# Time each decoder over each resource type; returns {(backend, type): records/sec}
+def benchmark_decoders(corpus, backends=None, repeat=3):
+    results = {}
+    for backend in backends or sorted(DECODERS):
+        loads = DECODERS[backend]
+        for resource_type, lines in corpus.items():
+            best = float("inf")
+            for _ in range(repeat):
+                started = time.perf_counter()
+                for line in lines:
+                    try:
+                        loads(line)
+                    except DECODE_ERRORS:
+                        pass
+                best = min(best, time.perf_counter() - started)
+            results[(backend, resource_type)] = len(lines) / best
+    return results
+
+# Fold encounters into the original {pid: {"first": tuple, "last": tuple}} layout
+def _legacy_activity_map(encounters):
+    activity_map = {}
+    for pid, start, end, loc_ref, start_key, end_key in encounters:
+        entry = activity_map.get(pid)
+        if entry is None:
+            activity_map[pid] = {"first": (start, loc_ref, start_key), "last": (end, loc_ref, end_key)}
+            continue
+        if start_key < entry["first"][2]:
+            entry["first"] = (start, loc_ref, start_key)
+        if end_key > entry["last"][2]:
+            entry["last"] = (end, loc_ref, end_key)
+    return activity_map
+
+def _compact_activity_map(encounters):
+    activity_map = ActivityStore()
+    for pid, start, end, loc_ref, start_key, end_key in encounters:
+        loc_code = activity_map.location_code(loc_ref)
+        activity_map.update(pid, start, start_key, loc_code, end, end_key, loc_code)
+    return activity_map
+
+# Retained memory of the dict-of-dicts layout vs ActivityStore, in bytes.
+# Inputs (timestamp and id strings) are built before tracing, so both numbers
+# are the structure overhead alone; both layouts keep the same strings alive.
+def benchmark_activity_memory(practitioners, encounters_per_practitioner=5, seed=0):
+    rng = random.Random(seed)
+    location_count = max(1, practitioners // 20)
+    encounters = []
+    for i in range(practitioners * encounters_per_practitioner):
+        start, end, loc_ref, actor_refs = encounter_fields(
+            encounter_record(rng, i, practitioners, location_count, participants=1))
+        loc_ref = normalize_location_key(loc_ref)
+        for actor_ref in actor_refs:
+            encounters.append((actor_ref.split("/")[-1], start, end, loc_ref,
+                               activity_sort_key(start), activity_sort_key(end)))
+
+    results = {}
+    for label, build in (("dict-of-dicts", _legacy_activity_map), ("ActivityStore", _compact_activity_map)):
+        tracemalloc.start()
+        activity_map = build(encounters)
+        results[label] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del activity_map
+    return results
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+# Generate a synthetic export under bench_dir and run the NDJSON_DataParsing.py CLI on it
+# in a subprocess. Returns one result record: params, the run's per-stage metrics report,
+# records/sec per stage and peak RSS
+def benchmark_pipeline(bench_dir, practitioners, encounters_per_practitioner=5, participants=2,
+                       corrupt_rate=0.0, seed=0, engine="python", incremental=True):
+    bench_dir = Path(bench_dir)
+    fhir_root = bench_dir / "XRegistry"
+    output_dir = bench_dir / "FHIR_Processed"
+    for stale in (fhir_root, output_dir):
+        if stale.exists():
+            shutil.rmtree(stale)
+
+    params = {"practitioners": practitioners, "encounters_per_practitioner": encounters_per_practitioner,
+              "participants": participants, "corrupt_rate": corrupt_rate, "seed": seed,
+              "engine": engine, "incremental": incremental}
+    started = time.perf_counter()
+    counts = write_bulk_export(fhir_root, practitioners, encounters_per_practitioner, participants,
+                               corrupt_rate, seed=seed)
+    generate_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    subprocess.run([sys.executable, str(REPO_DIR / "NDJSON_DataParsing.py"),
+                    "--input", str(fhir_root), "--output", str(output_dir), "--engine", engine]
+                   + ([] if incremental else ["--no-incremental"]),
+                   check=True, stdout=subprocess.DEVNULL)
+    total_seconds = time.perf_counter() - started
+
+    with open(output_dir / "run_report.json", encoding='utf-8') as f:
+        report = json.load(f)
+    stages = report["stages"]
+    lines = {resource_type: c["records"] + c["corrupt"] for resource_type, c in counts.items()}
+    return {
+        "revision": _git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "params": params,
+        "counts": counts,
+        "generate_seconds": generate_seconds,
+        "total_seconds": total_seconds,
+        "stages": stages,
+        "records_per_second": {stage: lines[STAGE_RECORDS[stage]] / metrics["wall_seconds"]
+                               for stage, metrics in stages.items()
+                               if stage in STAGE_RECORDS and metrics["wall_seconds"]},
+        # The run's own peak (the pipeline process or its largest worker), from its report
+        "peak_rss_mb": report["totals"]["peak_rss_mb"]
+    }
+
+# Helper: Most recent stored result with the same params (None if there is none)
+def previous_result(results_file, params):
+    previous = None
+    if Path(results_file).exists():
+        with open(results_file, encoding='utf-8') as f:
+            for line in f:
+                result = json.loads(line)
+                if result["params"] == params:
+                    previous = result
+    return previous
+
+# Helper: The final table of the last run in output_dir
+def _final_table(output_dir):
+    return pd.read_csv(Path(output_dir) / "practitioner_flat_table_with_locations.csv", dtype=str)
+
+# Helper: provider_ids whose rows differ between two final tables
+def _differing_providers(a, b):
+    merged = a.merge(b, how="outer", on=list(a.columns), indicator=True)
+    return sorted(set(merged.loc[merged["_merge"] != "both", "provider_id"]))
+
+# Run the python and duckdb engines on the same synthetic export (non-incremental, so
+# both do a full scan), then on the fixed edge-case export (FHIR_Synthetic), whose
+# ties, partial dates, offsets and missing periods the random one never produces.
+# Returns {engine: result} and {corpus: provider_ids whose rows differ between engines}
+def benchmark_engines(bench_dir, practitioners, encounters_per_practitioner=5, participants=2,
+                      corrupt_rate=0.0, seed=0):
+    results, tables = {}, {}
+    for engine in ("python", "duckdb"):
+        results[engine] = benchmark_pipeline(bench_dir, practitioners, encounters_per_practitioner,
+                                             participants, corrupt_rate, seed, engine, incremental=False)
+        tables[engine] = _final_table(Path(bench_dir) / "FHIR_Processed")
+    mismatches = {"synthetic": _differing_providers(tables["python"], tables["duckdb"])}
+
+    edge_root = Path(bench_dir) / "EdgeCases"
+    if edge_root.exists():
+        shutil.rmtree(edge_root)
+    write_edge_case_export(edge_root)
+    for engine in ("python", "duckdb"):
+        output_dir = Path(bench_dir) / f"EdgeCases_{engine}"
+        if output_dir.exists():
+            shutil.rmtree(output_dir)
+        subprocess.run([sys.executable, str(REPO_DIR / "NDJSON_DataParsing.py"), "--input", str(edge_root),
+                        "--output", str(output_dir), "--engine", engine, "--no-incremental"],
+                       check=True, stdout=subprocess.DEVNULL)
+        tables[engine] = _final_table(output_dir)
+    mismatches["edge cases"] = _differing_providers(tables["python"], tables["duckdb"])
+    return results, mismatches
+
+def append_result(results_file, result):
+    with open(results_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark NDJSON decoder backends on synthetic FHIR data")
+    parser.add_argument("--records", type=int, default=50_000, help="records per resource type")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes per backend (best is kept)")
+    parser.add_argument("--suite", choices=["decoders", "activity-memory", "pipeline", "engines", "all"],
+                        default="all")
+    parser.add_argument("--practitioners", type=int, default=100_000,
+                        help="practitioners for the activity-memory and pipeline suites")
+    parser.add_argument("--encounters-per-practitioner", type=int, default=5)
+    parser.add_argument("--participants", type=int, default=2, help="participants per Encounter")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="fraction of corrupt NDJSON lines")
+    parser.add_argument("--engine", choices=["python", "duckdb"], default="python",
+                        help="engine for the pipeline suite (the engines suite runs both)")
+    parser.add_argument("--bench-dir", help="where the pipeline suite writes its data (default: a temp dir)")
+    parser.add_argument("--results", default="benchmark_results.jsonl",
+                        help="pipeline results are appended here, one JSON line per run")
+    args = parser.parse_args()
+
+    if args.suite in ("decoders", "all"):
+        corpus = synthetic_corpus(args.records)
+        results = benchmark_decoders(corpus, repeat=args.repeat)
+
+        print(f"{'backend':<10}" + "".join(f"{t:>16}" for t in corpus) + "   (records/sec)")
+        for backend in sorted({b for b, _ in results}):
+            print(f"{backend:<10}" + "".join(f"{results[(backend, t)]:>16,.0f}" for t in corpus))
+
+    if args.suite in ("activity-memory", "all"):
+        results = benchmark_activity_memory(args.practitioners)
+        print(f"\nActivity map memory for {args.practitioners:,} practitioners:")
+        for label, size in results.items():
+            print(f"{label:<14}{size / 2**20:>10,.1f} MiB{size / args.practitioners:>10,.0f} bytes/practitioner")
+
+    if args.suite in ("pipeline", "all"):
+        bench_dir = args.bench_dir or tempfile.mkdtemp(prefix="fhir_bench_")
+        try:
+            result = benchmark_pipeline(bench_dir, args.practitioners, args.encounters_per_practitioner,
+                                        args.participants, args.corrupt_rate, engine=args.engine)
+        finally:
+            if not args.bench_dir:
+                shutil.rmtree(bench_dir, ignore_errors=True)
+        previous = previous_result(args.results, result["params"])
+        append_result(args.results, result)
+
+        print(f"\nPipeline at revision {result['revision']} "
+              f"({', '.join(f'{k}={v}' for k, v in result['params'].items())}):")
+        print(f"{'stage':<20}{'wall s':>9}{'cpu s':>9}{'records/sec':>14}{'peak MiB':>10}")
+        for stage, metrics in result["stages"].items():
+            rate = result["records_per_second"].get(stage)
+            peak = metrics["peak_rss_mb"]
+            line = (f"{stage:<20}{metrics['wall_seconds']:>9.2f}{metrics['cpu_seconds']:>9.2f}"
+                    f"{f'{rate:,.0f}' if rate else '':>14}{f'{peak:,.0f}' if peak else '':>10}")
+            before = previous and previous.get("stages", {}).get(stage)
+            if before and before["wall_seconds"]:
+                change = (metrics["wall_seconds"] / before["wall_seconds"] - 1) * 100
+                line += f"   {change:+.0f}% vs {previous['revision']}"
+            print(line)
+        print(f"{'total':<20}{result['total_seconds']:>9.2f}")
+        if result["peak_rss_mb"] is not None:
+            print(f"Peak RSS (largest process): {result['peak_rss_mb']:,.0f} MiB")
+        print(f"Result appended to {args.results}")
+
+    if args.suite in ("engines", "all"):
+        bench_dir = args.bench_dir or tempfile.mkdtemp(prefix="fhir_bench_")
+        try:
+            results, mismatches = benchmark_engines(bench_dir, args.practitioners, args.encounters_per_practitioner,
+                                                   args.participants, args.corrupt_rate)
+        finally:
+            if not args.bench_dir:
+                shutil.rmtree(bench_dir, ignore_errors=True)
+        for result in results.values():
+            append_result(args.results, result)
+
+        print(f"\nEngines on {args.practitioners:,} practitioners:")
+        print(f"{'engine':<10}{'encounter_scan s':>18}{'records/sec':>14}{'total s':>10}")
+        for engine, result in results.items():
+            print(f"{engine:<10}{result['stages']['encounter_scan']['wall_seconds']:>18.2f}"
+                  f"{result['records_per_second'].get('encounter_scan', 0):>14,.0f}"
+                  f"{result['total_seconds']:>10.2f}")
+        for corpus, providers in mismatches.items():
+            if providers:
+                print(f"🚨 {corpus}: final tables DIFFER between engines for {len(providers):,} provider_id(s), "
+                      f"e.g. {', '.join(providers[:5])}")
+            else:
+                print(f"✅ {corpus}: final tables identical")
+        if any(mismatches.values()):
+            sys.exit(1)
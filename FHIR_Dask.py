@@ -0,0 +1,105 @@
+from pathlib import Path
+import dask
+import dask.bag as db
+import dask.dataframe as dd
+import pyarrow.parquet as pq
+from FHIR_Locations import load_location_file
+from FHIR_Practitioners import PRACTITIONER_SCHEMA, SCORED_FIELDS, iter_practitioner_batches, batch_frame
+from FHIR_Dedup import ProviderIndex, provider_fingerprints, frame_completeness
+from FHIR_Activity import ActivityStore, reduce_encounter_file, activity_frame, enrich_batch
+
+# Dask execution of the whole pipeline. Every input file is one task; the Location
+# lookup and the first/last activity stores are combined by tree reductions (in file
+# order, so ties resolve as in a serial scan) and the enriched Practitioners are written
+# as partitioned Parquet and CSV. All paths must be readable from every worker.
+
+# Fan-in of each tree-reduction step
+SPLIT_EVERY = 8
+
+# Helper: Merge location lookups in order (later files win, as in the dict build)
+def merge_location_lookups(lookups):
+    merged = {}
+    for lookup in lookups:
+        merged.update(lookup)
+    return merged
+
+# Helper: Merge ActivityStores in order into a fresh store (task inputs are never mutated)
+def merge_activity_stores(stores):
+    merged = ActivityStore()
+    for store in stores:
+        merged.merge(store)
+    return merged
+
+# Helper: One Practitioner file as a DataFrame (every row; resolve_dedup picks the kept ones)
+def practitioner_file_frame(file, backend=None):
+    batches = [batch_frame(batch)
+               for batch in iter_practitioner_batches([file], float("inf"), backend)]
+    return batches[0] if batches else practitioner_meta()
+
+# Helper: The dedup index entries of one file frame: (fingerprints, completeness scores)
+def frame_dedup_keys(df, dedup):
+    scores = frame_completeness(df, SCORED_FIELDS) if dedup == "complete" else None
+    return provider_fingerprints(df["provider_id"].to_numpy(dtype=object)), scores
+
+# Helper: Resolve the global dedup across all files; one keep-mask per file frame
+def resolve_dedup(keys, dedup):
+    index = ProviderIndex(dedup)
+    for fingerprints, scores in keys:
+        index.add_fingerprints(fingerprints, scores)
+    return index.keep_masks()
+
+def select_rows(df, masks, position):
+    return df[masks[position]]
+
+def practitioner_meta():
+    return PRACTITIONER_SCHEMA.empty_table().to_pandas()
+
+# Helper: Connect to a scheduler address, or start a LocalCluster with `workers` processes.
+# The client owns a cluster it starts, so closing the client also shuts the cluster down
+def dask_client(scheduler=None, workers=None):
+    try:
+        from dask.distributed import Client
+    except ImportError as e:
+        raise ImportError(
+            "Dask mode needs the distributed scheduler: pip install distributed"
+        ) from e
+    if scheduler:
+        return Client(scheduler)
+    return Client(n_workers=workers, threads_per_worker=1)
+
+# Build and run the Dask graph; returns the number of enriched practitioner rows
+def run_dask_pipeline(location_files, practitioner_files, encounter_files, output_dir,
+                      backend=None, projection=False, dedup="last"):
+    output_dir = Path(output_dir)
+
+    locations = db.from_sequence(location_files or [None], partition_size=1).map(
+        lambda file: load_location_file(file, backend=backend) if file else {}
+    ).reduction(merge_location_lookups, merge_location_lookups, split_every=SPLIT_EVERY)
+
+    activity = db.from_sequence(encounter_files or [None], partition_size=1).map(
+        lambda file: reduce_encounter_file(file, backend=backend, projection=projection)
+        if file else ActivityStore()
+    ).reduction(merge_activity_stores, merge_activity_stores, split_every=SPLIT_EVERY)
+
+    # Persisted once, then shared by every Practitioner partition
+    activity_df = dask.delayed(activity_frame)(activity, locations).persist()
+
+    # provider_ids are deduplicated across files: only the fingerprints and scores of each
+    # file go to the one resolve task, which hands a keep-mask back to every file
+    meta = practitioner_meta()
+    frames = [dask.delayed(practitioner_file_frame)(file, backend) for file in practitioner_files]
+    masks = dask.delayed(resolve_dedup)([dask.delayed(frame_dedup_keys)(frame, dedup) for frame in frames],
+                                        dedup)
+    practitioners = dd.from_delayed(
+        [dask.delayed(select_rows)(frame, masks, position) for position, frame in enumerate(frames)] or
+        [dask.delayed(practitioner_meta)()],
+        meta=meta
+    )
+    enriched = practitioners.map_partitions(enrich_batch, activity_df, meta=meta)
+
+    # Parquet is written from the graph; the CSV parts are cheap re-reads of that Parquet
+    enriched.to_parquet(output_dir / "parquet", schema=PRACTITIONER_SCHEMA, write_index=False)
+    written = dd.read_parquet(output_dir / "parquet")
+    written.to_csv(str(output_dir / "csv" / "part-*.csv"), index=False)
+    return sum(pq.ParquetFile(part).metadata.num_rows
+               for part in (output_dir / "parquet").glob("*.parquet"))
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+# Global provider_id dedup across practitioner batches, files and workers.
+# Each provider_id is reduced to a 128-bit fingerprint (two vectorized 64-bit hashes with
+# different keys), so the index costs ~17 bytes per row in numpy arrays instead of a
+# Python string per id; a false match needs a 128-bit collision (~1e-22 at 100M ids).
+#
+# Policies for which row of a duplicated provider_id is kept:
+# - "first": the first occurrence, in file order
+# - "last": the last occurrence (the rule used within a batch so far)
+# - "complete": the row with the most non-empty fields; ties go to the last occurrence
+DEDUP_POLICIES = ("first", "last", "complete")
+
+# pandas hash keys must be 16 characters
+_HASH_KEYS = ("fhir-provider-hi", "fhir-provider-lo")
+
+# Helper: 128-bit fingerprints of provider_ids as two uint64 arrays (high, low)
+def provider_fingerprints(provider_ids):
+    ids = np.asarray(provider_ids, dtype=object)
+    return tuple(pd.util.hash_array(ids, hash_key=key, categorize=False) for key in _HASH_KEYS)
+
+# Helper: Completeness of every row of a frame, over the given columns
+def frame_completeness(df, columns):
+    values = df[columns]
+    return (values.notna() & values.ne("")).sum(axis=1).to_numpy(dtype=np.uint8)
+
+# Offline index: add every batch in order, then resolve which rows survive.
+# Resolution sorts the fingerprints once; peak memory is ~40 bytes per row
+class ProviderIndex:
+    def __init__(self, policy="last"):
+        if policy not in DEDUP_POLICIES:
+            raise ValueError(f"Unknown dedup policy {policy!r}; choose one of {DEDUP_POLICIES}")
+        self.policy = policy
+        self.highs = []
+        self.lows = []
+        self.scores = []
+
+    def __len__(self):
+        return sum(len(high) for high in self.highs)
+
+    # Record one batch of provider_ids (scores are only needed for the "complete" policy)
+    def add(self, provider_ids, scores=None):
+        self.add_fingerprints(provider_fingerprints(provider_ids), scores)
+
+    def add_fingerprints(self, fingerprints, scores=None):
+        high, low = fingerprints
+        self.highs.append(high)
+        self.lows.append(low)
+        if self.policy == "complete":
+            if scores is None:
+                raise ValueError("The 'complete' dedup policy needs completeness scores")
+            self.scores.append(np.asarray(scores, dtype=np.uint8))
+
+    # One boolean keep-mask per added batch: exactly one row per provider_id is True
+    def keep_masks(self):
+        sizes = [len(high) for high in self.highs]
+        if not sizes:
+            return []
+        high = np.concatenate(self.highs)
+        low = np.concatenate(self.lows)
+        rows = np.arange(len(high), dtype=np.int64)
+
+        # Sort so the winning row of every fingerprint comes first in its group
+        if self.policy == "first":
+            order = np.lexsort((rows, low, high))
+        elif self.policy == "last":
+            order = np.lexsort((-rows, low, high))
+        else:
+            order = np.lexsort((-rows, -np.concatenate(self.scores).astype(np.int16), low, high))
+        del rows
+
+        high, low = high[order], low[order]
+        group_start = np.empty(len(order), dtype=bool)
+        group_start[:1] = True
+        np.not_equal(high[1:], high[:-1], out=group_start[1:])
+        group_start[1:] |= low[1:] != low[:-1]
+
+        keep = np.zeros(len(order), dtype=bool)
+        keep[order[group_start]] = True
+        return np.split(keep, np.cumsum(sizes)[:-1])
+
+# Streaming "first wins" filter for modes that write rows as soon as they are parsed.
+# Seen fingerprints are kept as runs sorted on their high word that are merged as they
+# grow (like an LSM tree), so each batch costs a binary search per run, not a re-sort
+class SeenProviders:
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(len(high) for high, _ in self.runs)
+
+    # Helper: Which fingerprints (sorted on high) already appear in one run
+    @staticmethod
+    def _in_run(run, high, low):
+        run_high, run_low = run
+        left = np.searchsorted(run_high, high, side="left")
+        right = np.searchsorted(run_high, high, side="right")
+        found = np.zeros(len(high), dtype=bool)
+        single = right - left == 1
+        found[single] = run_low[left[single]] == low[single]
+        # Rare: several seen ids share the high 64 bits
+        for i in np.flatnonzero(right - left > 1):
+            found[i] = (run_low[left[i]:right[i]] == low[i]).any()
+        return found
+
+    # Mark a batch of provider_ids as seen; returns True for the rows seen for the first
+    # time (rows repeated within the batch count once, at their first position)
+    def first_seen(self, provider_ids):
+        high, low = provider_fingerprints(provider_ids)
+        order = np.lexsort((np.arange(len(high)), low, high))
+        high, low = high[order], low[order]
+
+        # Within the batch, keep only the first row of each fingerprint
+        new = np.ones(len(high), dtype=bool)
+        new[1:] = (high[1:] != high[:-1]) | (low[1:] != low[:-1])
+        for run in self.runs:
+            new &= ~self._in_run(run, high, low)
+
+        if new.any():
+            self._add_run(high[new], low[new])
+        keep = np.empty(len(new), dtype=bool)
+        keep[order] = new
+        return keep
+
+    def _add_run(self, high, low):
+        while self.runs and len(self.runs[-1][0]) <= 2 * len(high):
+            high, low = self._merge(self.runs.pop(), (high, low))
+        self.runs.append((high, low))
+
+    # Helper: Merge two runs sorted on high in one linear pass
+    @staticmethod
+    def _merge(a, b):
+        positions = np.searchsorted(a[0], b[0]) + np.arange(len(b[0]))
+        from_b = np.zeros(len(a[0]) + len(b[0]), dtype=bool)
+        from_b[positions] = True
+        merged = []
+        for a_values, b_values in zip(a, b):
+            values = np.empty(len(from_b), dtype=a_values.dtype)
+            values[from_b] = b_values
+            values[~from_b] = a_values
+            merged.append(values)
+        return tuple(merged)
+
+# Helper: Deduplicate one frame on provider_id under a policy (rows stay in their order);
+# score_columns are the columns counted by the "complete" policy
+def dedup_frame(df, policy, score_columns=()):
+    index = ProviderIndex(policy)
+    scores = frame_completeness(df, list(score_columns)) if policy == "complete" else None
+    index.add(df["provider_id"].to_numpy(dtype=object), scores)
+    masks = index.keep_masks()
+    return df[masks[0]] if masks else df
@@ -0,0 +1,131 @@
+import json
+import os
+import pandas as pd
+from FHIR_Helpers import activity_sort_key
+from FHIR_Activity import ACTIVITY_COLUMNS
+from FHIR_Locations import lookup_addresses
+
+# DuckDB engine for STEP 6-7a: the first/last activity GROUP BY over Encounters and its
+# join to Locations, run in an embedded columnar SQL engine that reads the NDJSON
+# directly. The Python reducer (FHIR_Activity) stays the reference; this follows its
+# rules exactly:
+# - the first location with a non-empty reference, normalized like normalize_location_key
+# - start/end compared as UTC epoch microseconds (offset-less values taken as UTC)
+# - ties go to the Encounter seen first, in file order
+# - Encounters with neither start nor end are skipped, as are corrupt lines
+
+# Only the fields the reducer reads are extracted from each line
+ENCOUNTER_STRUCTURE = json.dumps({
+    "period": {"start": "VARCHAR", "end": "VARCHAR"},
+    "participant": [{"individual": {"reference": "VARCHAR"}}],
+    "location": [{"location": {"reference": "VARCHAR"}}]
+})
+
+# Aggregate every participation into one row per provider_id (the GROUP BY of STEP 6)
+ACTIVITY_SQL = """
+CREATE TEMP TABLE activity AS
+WITH records AS (
+    -- Lines are read as raw JSON objects: read_json's own error recovery can also
+    -- drop the valid line after a corrupt one, whereas here only the bad line is NULL
+    SELECT ordinality AS seen, json_transform(json, $structure) AS rec
+    FROM read_ndjson_objects($files, ignore_errors = true) WITH ORDINALITY
+),
+encounters AS (
+    SELECT seen,
+           NULLIF(rec.period."start", '') AS "start",
+           NULLIF(rec.period."end", '') AS "end",
+           list_filter(rec.location, l -> COALESCE(l.location.reference, '') <> '')[1].location.reference AS loc_ref,
+           rec.participant AS participant
+    FROM records
+),
+keyed AS (
+    SELECT seen, "start", "end", participant,
+           CASE WHEN starts_with(lower(trim(loc_ref)), 'location/') THEN lower(trim(loc_ref))
+                ELSE 'location/' || lower(trim(loc_ref)) END AS location,
+           sort_key("start") AS start_key,
+           sort_key("end") AS end_key
+    FROM encounters
+    WHERE "start" IS NOT NULL OR "end" IS NOT NULL
+),
+participations AS (
+    SELECT string_split(actor.individual.reference, '/')[-1] AS provider_id, *
+    FROM (SELECT *, unnest(participant) AS actor FROM keyed)
+    WHERE starts_with(actor.individual.reference, 'Practitioner/')
+)
+SELECT provider_id,
+       first.date AS first_activity_date, first.location AS first_activity_location,
+       last.date AS last_activity_date, last.location AS last_activity_location
+FROM (
+    -- Pick date and location together, as arg_min/arg_max skip NULL values on their own
+    SELECT provider_id,
+           arg_min({'date': "start", 'location': location}, [start_key, seen])
+               FILTER (WHERE "start" IS NOT NULL) AS first,
+           arg_max({'date': "end", 'location': location}, [end_key, -seen])
+               FILTER (WHERE "end" IS NOT NULL) AS last
+    FROM participations
+    WHERE provider_id <> ''
+    GROUP BY provider_id
+)
+"""
+
+# Join the aggregate to the addresses of the locations it references
+ENRICH_SQL = """
+SELECT activity.provider_id,
+       first_activity_date, first_activity_location, first_location.address AS first_activity_address,
+       last_activity_date, last_activity_location, last_location.address AS last_activity_address
+FROM activity
+LEFT JOIN locations AS first_location ON first_location.key = activity.first_activity_location
+LEFT JOIN locations AS last_location ON last_location.key = activity.last_activity_location
+"""
+
+# Helper: Open a DuckDB connection (DuckDB is optional; only this engine needs it)
+def duckdb_connect(threads=None):
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("The duckdb engine needs DuckDB: pip install duckdb") from e
+    con = duckdb.connect()
+    con.execute("SET TimeZone = 'UTC'")
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    # ISO instants and plain dates are cast natively; anything else (partial dates
+    # like "2021-03") goes through the Python reference key
+    con.create_function("python_sort_key", activity_sort_key, ["VARCHAR"], "BIGINT",
+                        null_handling="special")
+    con.execute("""CREATE MACRO sort_key(ts) AS
+                   CASE WHEN ts IS NULL THEN NULL
+                        WHEN TRY_CAST(ts AS TIMESTAMPTZ) IS NOT NULL THEN epoch_us(TRY_CAST(ts AS TIMESTAMPTZ))
+                        ELSE python_sort_key(ts) END""")
+    return con
+
+# Build the activity table (same shape as FHIR_Activity.activity_frame) from Encounter
+# NDJSON with DuckDB. location_lookup is the dict or LocationIndex from STEP 3
+def duckdb_activity_frame(encounter_files, location_lookup, threads=None):
+    unsupported = [file for file in encounter_files if os.fspath(file).endswith(".bz2")]
+    if unsupported:
+        raise ValueError(f"The duckdb engine cannot read bz2 shards ({unsupported[0]}); "
+                         "recompress them as .gz or .zst or use the python engine")
+
+    con = duckdb_connect(threads)
+    try:
+        if not encounter_files:
+            return pd.DataFrame(columns=ACTIVITY_COLUMNS,
+                                index=pd.Index([], name="provider_id", dtype=object), dtype=object)
+
+        con.execute(ACTIVITY_SQL, {"files": [os.fspath(file) for file in encounter_files],
+                                   "structure": ENCOUNTER_STRUCTURE})
+
+        # Only the locations that won a first/last pick are looked up
+        keys = [row[0] for row in con.execute("""
+            SELECT first_activity_location FROM activity WHERE first_activity_location IS NOT NULL
+            UNION
+            SELECT last_activity_location FROM activity WHERE last_activity_location IS NOT NULL
+        """).fetchall()]
+        locations = pd.DataFrame({"key": pd.Series(keys, dtype=object),
+                                  "address": pd.Series(lookup_addresses(location_lookup, keys), dtype=object)})
+        con.register("locations", locations)
+        frame = con.execute(ENRICH_SQL).df()
+    finally:
+        con.close()
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.set_index(pd.Index(frame.pop("provider_id"), name="provider_id", dtype=object))[ACTIVITY_COLUMNS]
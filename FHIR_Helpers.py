@@ -0,0 +1,94 @@
+import warnings
+from functools import partial
+from multiprocessing import Pool
+from datetime import datetime, timedelta, timezone
+from dateutil.parser import parse as dt_parse
+import numpy as np
+import pandas as pd
+from FHIR_Metrics import PROFILING, run_measured, absorb_usage
+
+# Helper: Normalize location keys for consistent lookups
+def normalize_location_key(ref):
+    if not ref:
+        return None
+    ref = ref.strip().lower()
+    return ref if ref.startswith("location/") else f"location/{ref}"
+
+# Helper: Turn a FHIR date/dateTime/instant into a sortable epoch-microsecond key
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+# Fields a partial date leaves out ("2021-03" has no day) are taken from here rather than
+# from today's date, so keys persisted in incremental state never depend on the run date
+_PARTIAL_DATE_DEFAULT = datetime(1970, 1, 1)
+
+def activity_sort_key(ts):
+    try:
+        # Fast path: ISO-8601 instants ("2021-03-04T05:06:07.123Z", "+02:00" offsets, plain dates)
+        dt = datetime.fromisoformat(ts)
+    except ValueError:
+        # Partial dates ("2021-03") and anything unusual still go through dateutil
+        dt = dt_parse(ts, default=_PARTIAL_DATE_DEFAULT)
+    if dt.tzinfo is None:
+        # Treat offset-less values as UTC so they compare against offset-aware ones
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // _ONE_MICROSECOND
+
+# Helper: activity_sort_key over many timestamps at once, as an int64 array (`missing` where
+# a timestamp is None). Each distinct value is parsed once: "YYYY-MM-DD..." values have
+# their UTC offset ("Z", "+02:00") split off with numpy string ufuncs, are parsed in one
+# vectorized pass as datetime64[us] and shifted to UTC (offset-less values taken as UTC),
+# matching activity_sort_key. Partial dates and other forms go through activity_sort_key
+def activity_sort_keys(timestamps, missing):
+    codes, uniques = pd.factorize(np.asarray(timestamps, dtype=object))
+    if not len(uniques):
+        return np.full(len(codes), missing, dtype=np.int64)
+    values = uniques.astype(str)
+    lengths = np.strings.str_len(values)
+
+    # The last six characters as code points: sign, h, h, ":", m, m for "+02:00" offsets
+    tail = np.strings.slice(values, -6, lengths).astype("<U6").view(np.uint32).reshape(-1, 6)
+    digits = tail.astype(np.int64) - ord("0")
+    zulu = tail[:, 5] == ord("Z")
+    offset = ((lengths > 16) & np.isin(tail[:, 0], [ord("+"), ord("-")]) & (tail[:, 3] == ord(":"))
+              & ((digits[:, [1, 2, 4, 5]] >= 0) & (digits[:, [1, 2, 4, 5]] <= 9)).all(axis=1))
+    local = np.strings.slice(values, 0, lengths - np.where(zulu, 1, np.where(offset, 6, 0)))
+
+    # Only plain "YYYY-MM-DD[Thh:mm...]" is left to numpy (any other sign, e.g. "+0530",
+    # would hit numpy's deprecated timezone parsing)
+    iso = ((lengths >= 10) & (np.strings.slice(values, 4, 5) == "-")
+           & (np.strings.slice(values, 7, 8) == "-")
+           & (np.strings.find(local, "+", 10) < 0) & (np.strings.find(local, "-", 10) < 0))
+
+    keys = np.zeros(len(values), dtype=np.int64)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            keys[iso] = local[iso].astype("datetime64[us]").view(np.int64)
+    except (ValueError, Warning):
+        # Something numpy does not read as we do (e.g. "24:00"); keep the reference path for all
+        iso[:] = False
+    shift = (digits[:, 1] * 600 + digits[:, 2] * 60 + digits[:, 4] * 10 + digits[:, 5]) * 60_000_000
+    keys -= np.where(offset & iso, np.where(tail[:, 0] == ord("-"), -shift, shift), 0)
+    for i in np.flatnonzero(~iso):
+        keys[i] = activity_sort_key(uniques[i])
+    return np.append(keys, missing)[codes]
+
+# Helper: Split files into contiguous runs for worker processes (one run when workers <= 1).
+# Contiguous runs merged back in order keep first-seen tie-breaking identical to a serial scan
+def file_chunks(files, workers):
+    if workers <= 1 or len(files) <= 1:
+        return [files] if files else []
+    chunk_size = max(1, -(-len(files) // (workers * 4)))
+    return [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+
+# Helper: Run func over tasks in a process pool (or in this process), yielding results in order.
+# Pool workers send back their metrics counters, CPU time, peak memory and per-file
+# times with each result (and dump a cProfile when a profiled run is active)
+def run_tasks(func, tasks, workers):
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            for result, usage in pool.imap(partial(run_measured, func, PROFILING["dir"]), tasks):
+                absorb_usage(usage)
+                yield result
+    else:
+        yield from map(func, tasks)
@@ -0,0 +1,145 @@
+import sqlite3
+from pathlib import Path
+import numpy as np
+from NDJSON_Decoding import iter_ndjson
+from FHIR_Helpers import normalize_location_key
+
+# Id for "no location" in a LocationTable (and location code in an ActivityStore)
+NO_LOCATION = -1
+
+# Interned location references: every normalized key gets a small integer id, with the
+# address of each id (None until a Location row provides one). Raw references from
+# Encounters are memoized to their id, so each distinct raw string is normalized once.
+# STEP 3 fills one with the Location files (dict-style, through load_location_file);
+# activity stores that share it store these ids, and their addresses are an array index
+class LocationTable:
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+        self.addresses = []
+        self.raw_ids = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Intern a normalized key (None -> NO_LOCATION)
+    def intern(self, key):
+        if key is None:
+            return NO_LOCATION
+        location_id = self.ids.get(key)
+        if location_id is None:
+            location_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            self.addresses.append(None)
+        return location_id
+
+    # Intern a raw reference ("Location/abc", " ABC ") through the normalization memo
+    def intern_raw(self, ref):
+        location_id = self.raw_ids.get(ref)
+        if location_id is None:
+            location_id = self.raw_ids[ref] = self.intern(normalize_location_key(ref))
+        return location_id
+
+    # Dict-style access by normalized key, as used by load_location_file and lookup_addresses
+    def __setitem__(self, key, address):
+        if key is not None:
+            self.addresses[self.intern(key)] = address
+
+    def get(self, key, default=None):
+        location_id = self.ids.get(key)
+        address = self.addresses[location_id] if location_id is not None else None
+        return default if address is None else address
+
+    # keys / addresses by id as object arrays; the trailing None is what NO_LOCATION (-1) picks
+    def key_array(self):
+        return np.array(self.keys + [None], dtype=object)
+
+    def address_array(self):
+        return np.array(self.addresses + [None], dtype=object)
+
+    # The raw-reference memo is a cache; it is not pickled with saved or shipped state
+    def __getstate__(self):
+        return {"ids": self.ids, "keys": self.keys, "addresses": self.addresses}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.raw_ids = {}
+
+# Helper: Load one Location NDJSON file into {normalized location key: display address}
+# (a dict, or a LocationTable passed as location_lookup)
+def load_location_file(file, location_lookup=None, backend=None):
+    if location_lookup is None:
+        location_lookup = {}
+
+    for rec in iter_ndjson(file, backend):
+        loc_id = rec.get("id")
+        name = rec.get("name", "")
+        address_obj = rec.get("address", {})
+
+        address = ", ".join(filter(None, [
+            " ".join(address_obj.get("line", [])),
+            address_obj.get("city"),
+            address_obj.get("state"),
+            address_obj.get("postalCode"),
+            address_obj.get("country")
+        ])).strip()
+
+        loc_key = normalize_location_key(loc_id)
+        full = f"{name} ({address})" if name else address
+        location_lookup[loc_key] = full
+
+    return location_lookup
+
+# On-disk location lookup (SQLite), keyed by normalize_location_key output.
+# Rows are stored per source file so a changed or removed Location file can be
+# replaced on its own; when an id appears in several files the last file in
+# path order wins, exactly like the in-memory dict built by a full scan.
+class LocationIndex:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.path)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS location_rows ("
+            " file TEXT NOT NULL, key TEXT, address TEXT, PRIMARY KEY (key, file))"
+        )
+        self.con.execute("CREATE INDEX IF NOT EXISTS location_rows_file ON location_rows (file)")
+
+    # Replace every row that came from one Location file
+    def replace_file(self, file_key, lookup):
+        with self.con:
+            self.con.execute("DELETE FROM location_rows WHERE file = ?", (file_key,))
+            self.con.executemany(
+                "INSERT INTO location_rows (file, key, address) VALUES (?, ?, ?)",
+                ((file_key, key, address) for key, address in lookup.items() if key is not None)
+            )
+
+    def remove_file(self, file_key):
+        with self.con:
+            self.con.execute("DELETE FROM location_rows WHERE file = ?", (file_key,))
+
+    # Addresses for many keys in one query (None where a key is unknown)
+    def get_many(self, keys):
+        with self.con:
+            self.con.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (pos INTEGER PRIMARY KEY, key TEXT)")
+            self.con.execute("DELETE FROM wanted")
+            self.con.executemany("INSERT INTO wanted (pos, key) VALUES (?, ?)", enumerate(keys))
+            rows = self.con.execute(
+                "SELECT (SELECT address FROM location_rows r WHERE r.key = w.key"
+                " ORDER BY r.file DESC LIMIT 1) FROM wanted w ORDER BY w.pos"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        return self.con.execute("SELECT COUNT(DISTINCT key) FROM location_rows").fetchone()[0]
+
+    def close(self):
+        self.con.close()
+
+# Helper: Addresses for a list of normalized keys from a dict, LocationTable or LocationIndex
+def lookup_addresses(location_lookup, keys):
+    if isinstance(location_lookup, LocationIndex):
+        return location_lookup.get_many(keys)
+    return [location_lookup.get(key) for key in keys]
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+
+# 2: partial-date sort keys no longer depend on the run date
+MANIFEST_VERSION = 2
+
+# Helper: SHA-256 of a file's contents
+def file_digest(file):
+    with open(file, 'rb') as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+# Helper: Persist / restore per-file state (location dicts, ActivityStores)
+def save_state(obj, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+def load_state(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+# Record of processed NDJSON files for incremental reruns.
+# Each file gets a stable integer id (used to name its batches and state files)
+# plus its size, mtime and content hash. Files whose size and mtime are unchanged
+# are skipped without hashing; touched-but-identical files are caught by the hash.
+class Manifest:
+    def __init__(self, state_dir, root):
+        self.state_dir = Path(state_dir)
+        self.root = Path(root)
+        self.path = self.state_dir / "manifest.json"
+        self.entries = {}
+        self.pending = {}
+        self.next_id = 0
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != MANIFEST_VERSION:
+                raise RuntimeError(
+                    f"🚨 Manifest {self.path} has version {data.get('version')}, "
+                    f"expected {MANIFEST_VERSION}. Delete the state directory to rebuild from scratch."
+                )
+            self.entries = data["files"]
+            self.next_id = data["next_id"]
+
+    # Manifest keys are paths relative to the FHIR root, so the root itself can move
+    def key(self, file):
+        return Path(file).relative_to(self.root).as_posix()
+
+    def file_id(self, file):
+        key = self.key(file)
+        entry = self.pending.get(key) or self.entries[key]
+        return entry["id"]
+
+    # Per-file pickled state for one resource type
+    def state_file(self, kind, file_id):
+        return self.state_dir / kind / f"{file_id:06d}.pkl"
+
+    # Compare one resource type's files against the manifest.
+    # Returns (files to process, manifest entries for files that disappeared;
+    # each removed entry also carries its manifest "key")
+    def plan(self, kind, files):
+        to_process = []
+        seen = set()
+        for file in files:
+            key = self.key(file)
+            seen.add(key)
+            stat = os.stat(file)
+            entry = self.entries.get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                continue
+
+            digest = file_digest(file)
+            if entry and entry["sha256"] == digest:
+                entry["mtime_ns"] = stat.st_mtime_ns
+                continue
+
+            if entry:
+                file_id = entry["id"]
+            else:
+                file_id = self.next_id
+                self.next_id += 1
+            self.pending[key] = {"kind": kind, "id": file_id, "size": stat.st_size,
+                                 "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+            to_process.append(file)
+
+        removed = [key for key, entry in self.entries.items()
+                   if entry["kind"] == kind and key not in seen]
+        return to_process, [{"key": key, **self.entries.pop(key)} for key in removed]
+
+    # Mark a planned file as processed; extra fields (e.g. batch names) are stored with it
+    def commit(self, file, **extra):
+        key = self.key(file)
+        self.entries[key] = {**self.pending.pop(key), **extra}
+
+    # Forget every file of one resource type so the next plan() reprocesses them all
+    def reset(self, kind):
+        for key in [key for key, entry in self.entries.items() if entry["kind"] == kind]:
+            del self.entries[key]
+
+    def entry(self, file):
+        return self.entries[self.key(file)]
+
+    def save(self):
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "next_id": self.next_id, "files": self.entries},
+                      f, indent=1)
+        os.replace(tmp, self.path)
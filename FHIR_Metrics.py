@@ -0,0 +1,173 @@
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import sys
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Work counters for this process. Worker processes send theirs back through
+# FHIR_Helpers.run_tasks, so the parent's counters cover the whole run.
+COUNTERS = {
+    "lines_read": 0,           # NDJSON lines handed to a decoder
+    "corrupt_lines": 0,        # lines skipped as corrupt JSON
+    "bytes_read": 0,           # NDJSON bytes read (after decompression)
+    "batches_written": 0,
+    "batch_write_seconds": 0.0
+}
+
+# CPU time and peak memory reported by worker processes since the last stage mark
+WORKER_USAGE = {"cpu_seconds": 0.0, "peak_rss_mb": 0.0}
+
+# Seconds spent on each input file (or ByteRange) since the last stage mark, by name
+FILE_SECONDS = {}
+
+# Slowest files listed per stage in the run report
+SLOWEST_FILES = 10
+
+# Where worker tasks dump cProfile stats while a profiled run is active (None = off)
+PROFILING = {"dir": None}
+_profile_seq = itertools.count()
+
+# Helper: Charge processing time to one input file
+def record_file_seconds(file, seconds):
+    name = str(file)
+    FILE_SECONDS[name] = FILE_SECONDS.get(name, 0.0) + seconds
+
+# Helper: Peak resident memory of this process so far, in MiB (None if unavailable)
+def peak_rss_mb():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # bytes on macOS, KiB elsewhere
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                    "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize / 2**20
+    return None
+
+# Worker side: run func(task) and return (result, counters, CPU and per-file time used by
+# this call). With profile_dir set, the call runs under cProfile and its stats are dumped
+# there for the parent to merge into the stage's profile
+def run_measured(func, profile_dir, task):
+    before = dict(COUNTERS)
+    FILE_SECONDS.clear()
+    cpu = time.process_time()
+    if profile_dir:
+        profile = cProfile.Profile()
+        result = profile.runcall(func, task)
+        profile.dump_stats(Path(profile_dir) / f"worker_{os.getpid()}_{next(_profile_seq)}.pstats")
+    else:
+        result = func(task)
+    usage = {key: COUNTERS[key] - before[key] for key in COUNTERS}
+    usage["cpu_seconds"] = time.process_time() - cpu
+    usage["peak_rss_mb"] = peak_rss_mb() or 0.0
+    usage["file_seconds"] = dict(FILE_SECONDS)
+    FILE_SECONDS.clear()
+    return result, usage
+
+# Parent side: fold one worker call's usage into this process's totals
+def absorb_usage(usage):
+    for key in COUNTERS:
+        COUNTERS[key] += usage[key]
+    WORKER_USAGE["cpu_seconds"] += usage["cpu_seconds"]
+    WORKER_USAGE["peak_rss_mb"] = max(WORKER_USAGE["peak_rss_mb"], usage["peak_rss_mb"])
+    for name, seconds in usage["file_seconds"].items():
+        record_file_seconds(name, seconds)
+
+# Per-stage metrics for one pipeline run, recorded at stage boundaries:
+# wall and CPU seconds (this process plus workers), the COUNTERS deltas, peak
+# memory (this process's high-water mark at the end of the stage, or the largest
+# worker's if higher) and the slowest files.
+# With profile_dir set, each stage also runs under cProfile (this process and every
+# worker task) and is written as <stage>.pstats, plus a <stage>.txt summary. The
+# .pstats files load in pstats, snakeviz, or flameprof / gprof2dot for flame graphs
+class RunMetrics:
+    def __init__(self, profile_dir=None):
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.profile = None
+        if self.profile_dir:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            for stale in self.profile_dir.glob("*.pstats"):
+                stale.unlink()
+        PROFILING["dir"] = self.profile_dir
+        self._reset()
+
+    def _reset(self):
+        self.last_wall = time.perf_counter()
+        self.last_cpu = time.process_time()
+        self.last_counters = dict(COUNTERS)
+        WORKER_USAGE.update(cpu_seconds=0.0, peak_rss_mb=0.0)
+        FILE_SECONDS.clear()
+        if self.profile_dir:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    # Merge this process's profile with the worker dumps of the stage into <stage>.pstats
+    def _save_profile(self, stage):
+        self.profile.disable()
+        stats = pstats.Stats(self.profile)
+        worker_dumps = sorted(self.profile_dir.glob("worker_*.pstats"))
+        for dump in worker_dumps:
+            stats.add(str(dump))
+            dump.unlink()
+        stats.dump_stats(self.profile_dir / f"{stage}.pstats")
+        with open(self.profile_dir / f"{stage}.txt", 'w', encoding='utf-8') as f:
+            pstats.Stats(str(self.profile_dir / f"{stage}.pstats"), stream=f) \
+                .sort_stats("cumulative").print_stats(40)
+
+    # Charge everything since the previous mark to stage
+    def mark(self, stage):
+        if self.profile_dir:
+            self._save_profile(stage)
+        metrics = self.stages.setdefault(stage, {"wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                 **{key: 0 for key in COUNTERS}, "peak_rss_mb": None})
+        metrics["wall_seconds"] += time.perf_counter() - self.last_wall
+        metrics["cpu_seconds"] += time.process_time() - self.last_cpu + WORKER_USAGE["cpu_seconds"]
+        for key in COUNTERS:
+            metrics[key] += COUNTERS[key] - self.last_counters[key]
+        peaks = [peak for peak in (peak_rss_mb(), WORKER_USAGE["peak_rss_mb"], metrics["peak_rss_mb"])
+                 if peak]
+        metrics["peak_rss_mb"] = max(peaks) if peaks else None
+        slowest = sorted(FILE_SECONDS.items(), key=lambda item: item[1], reverse=True)[:SLOWEST_FILES]
+        metrics["slowest_files"] = [{"file": name, "seconds": seconds} for name, seconds in slowest]
+        self._reset()
+
+    def report(self):
+        totals = {key: sum(stage[key] for stage in self.stages.values())
+                  for key in ("cpu_seconds", *COUNTERS)}
+        peaks = [stage["peak_rss_mb"] for stage in self.stages.values() if stage["peak_rss_mb"]]
+        return {
+            "stages": self.stages,
+            "totals": {"wall_seconds": time.perf_counter() - self.started, **totals,
+                       "peak_rss_mb": max(peaks) if peaks else None}
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=1)
+
+    # Stop profiling (call once the run is over)
+    def close(self):
+        if self.profile:
+            self.profile.disable()
+        PROFILING["dir"] = None
@@ -0,0 +1,562 @@
+import argparse
+import os
+import shutil
+from functools import partial
+from pathlib import Path
+from tqdm import tqdm
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from FHIR_Helpers import file_chunks, run_tasks
+from FHIR_Metrics import RunMetrics
+from NDJSON_IO import check_codecs, find_ndjson_files, prefetch_files, split_ndjson_files
+from FHIR_Locations import LocationIndex, LocationTable, load_location_file
+from FHIR_Practitioners import (PRACTITIONER_SCHEMA, PRACTITIONER_FIELDS, SCORED_FIELDS,
+                                batch_file_name, extract_practitioner_shard, read_batch,
+                                iter_practitioner_batches, batch_frame, append_final_output)
+from FHIR_Activity import (ActivityStore, reduce_encounter_files, reduce_encounter_file_to_state,
+                           activity_frame, enrich_batch, changed_providers)
+from FHIR_Manifest import Manifest, load_state
+from FHIR_Dedup import DEDUP_POLICIES, ProviderIndex, SeenProviders, dedup_frame, frame_completeness
+from FHIR_DuckDB import duckdb_activity_frame
+from FHIR_Spill import (SPILL_ROW_BYTES, spill_encounter_files, spill_practitioner_files,
+                        reduce_spilled_partition, read_practitioner_partition)
+
+DEFAULT_FHIR_ROOT = Path.home() / "OneDrive - APMA" / "XRegistry"
+
+# Settings and output paths for one pipeline run
+class PipelineConfig:
+    def __init__(self, fhir_root=DEFAULT_FHIR_ROOT, output_dir=None, batch_size=100_000, workers=None,
+                 incremental=None, single_pass=False, activity_partitions=0, spill_memory_mb=512,
+                 dask_mode=False, dask_scheduler=None, json_backend=None, encounter_projection=False,
+                 readahead_mb=64, split_file_mb=256, write_parquet=True, profile=False, engine="python",
+                 dedup=None):
+        # Input: <fhir_root>/<resource type>/<export>/*.ndjson[.gz|.bz2|.zst]
+        self.fhir_root = Path(fhir_root)
+        self.output_dir = Path(output_dir) if output_dir else self.fhir_root.parent / "FHIR_Processed"
+        self.batch_dir = self.output_dir / "batches"
+        self.final_output = self.output_dir / "practitioner_flat_table_with_locations.csv"
+        # Also write the final table as Parquet (None = CSV only)
+        self.final_output_parquet = (self.output_dir / "practitioner_flat_table_with_locations.parquet"
+                                     if write_parquet else None)
+        # Per-stage metrics of the run as JSON: wall/CPU seconds, lines read and skipped as
+        # corrupt, bytes read, batch writes and peak memory (also read by FHIR_Benchmark)
+        self.run_report = self.output_dir / "run_report.json"
+        # Opt-in cProfile of every stage (this process and the workers), written to
+        # profile_dir as <stage>.pstats and <stage>.txt
+        self.profile_dir = self.output_dir / "profile" if profile else None
+
+        self.batch_size = batch_size
+        # Worker processes for the Practitioner and Encounter scans (1 = run in this process)
+        self.practitioner_workers = self.encounter_workers = workers or os.cpu_count() or 1
+
+        # Incremental mode: keep a manifest of processed files plus per-file state under
+        # state_dir, and on reruns only parse new or changed NDJSON files
+        # (None = on for batched python-engine runs, the only ones that keep such state)
+        self.incremental = incremental
+        self.state_dir = self.output_dir / "state"
+        self.enriched_dir = self.output_dir / "enriched"
+        self.activity_state = self.state_dir / "activity.parquet"
+        self.location_index = self.state_dir / "locations.sqlite"
+
+        # Single pass: scan Encounters first, then stream Practitioners straight into the
+        # enriched final output, with no intermediate batch files (not incremental)
+        self.single_pass = single_pass
+
+        # Spill-to-disk aggregation for registries whose practitioners do not fit in RAM:
+        # 0 = keep activity in memory; N = hash-partition provider_ids into N on-disk
+        # partitions and reduce/join one partition at a time (not incremental).
+        # Peak memory is about spill_memory_mb while spilling, then one partition's
+        # activity (~150 bytes per practitioner) plus its practitioner rows
+        self.activity_partitions = activity_partitions
+        self.spill_memory_mb = spill_memory_mb
+        self.spill_dir = self.output_dir / "spill"
+
+        # Dask mode: run the whole pipeline as a Dask graph (one task per file, tree-reduced
+        # activity) and write partitioned output to dask_output_dir. dask_scheduler is a
+        # scheduler address such as "tcp://10.0.0.5:8786"; None starts a LocalCluster
+        self.dask_mode = dask_mode
+        self.dask_scheduler = dask_scheduler
+        self.dask_output_dir = self.output_dir / "dask_output"
+
+        # Encounter aggregation engine: "python" (the reference reducer) or "duckdb", which
+        # runs the first/last GROUP BY and the Location join in DuckDB straight off the
+        # NDJSON (needs the duckdb package; not incremental, no spill, no .bz2 input)
+        self.engine = engine
+
+        # NDJSON decoder: "orjson", "json" or "simdjson" (None = orjson if installed, else json)
+        self.json_backend = json_backend
+
+        # Read Encounters through the ijson field projection instead of full decoding.
+        # Keeps per-line memory flat for very large Encounters; orjson full decode is
+        # faster for typical ones, so this is off by default
+        self.encounter_projection = encounter_projection
+
+        # Read ahead up to this many MiB of upcoming NDJSON on a background thread while the
+        # current file is parsed, so OneDrive hydration and disk reads overlap decoding
+        # (0 = plain reads). Each worker process keeps its own readahead buffer
+        self.readahead_mb = readahead_mb
+
+        # Uncompressed shards larger than this are split into newline-aligned byte ranges
+        # (memory-mapped by each worker) so one huge file is not a straggler (0 = never split).
+        # Incremental runs keep whole files, since the manifest tracks files
+        self.split_file_mb = split_file_mb
+
+        # Which row of a provider_id found more than once (in any batch, file or worker) is
+        # kept: "first", "last" or "complete" (most non-empty fields; see FHIR_Dedup).
+        # Single pass writes rows as they are parsed, so it can only keep the first;
+        # None = "first" for single pass, else "last"
+        self.dedup = dedup or ("first" if single_pass else "last")
+
+        if self.incremental is None:
+            self.incremental = self.batched and self.engine == "python"
+
+    # Practitioners go through intermediate batch files (every mode but these three)
+    @property
+    def batched(self):
+        return not (self.single_pass or self.activity_partitions or self.dask_mode)
+
+    def validate(self):
+        if self.dask_mode and (self.incremental or self.single_pass or self.activity_partitions):
+            raise ValueError("dask_mode cannot be combined with incremental, single_pass or activity_partitions")
+        if self.incremental and (self.single_pass or self.activity_partitions):
+            raise ValueError("single_pass and activity_partitions keep no batches, "
+                             "so they cannot be combined with incremental")
+        if self.single_pass and self.activity_partitions:
+            raise ValueError("Choose either single_pass or activity_partitions")
+        if self.engine not in ("python", "duckdb"):
+            raise ValueError(f"Unknown engine {self.engine!r}; choose 'python' or 'duckdb'")
+        if self.engine == "duckdb" and (self.incremental or self.activity_partitions or self.dask_mode):
+            raise ValueError("The duckdb engine cannot be combined with incremental, "
+                             "activity_partitions or dask_mode")
+        if self.dedup not in DEDUP_POLICIES:
+            raise ValueError(f"Unknown dedup policy {self.dedup!r}; choose one of {DEDUP_POLICIES}")
+        if self.single_pass and self.dedup != "first":
+            raise ValueError("single_pass streams practitioners, so it only supports dedup='first'")
+
+# STEP 3: Build the location lookup table (a LocationTable, which STEP 6 also interns
+# Encounter references into, or the persistent LocationIndex when a manifest is given)
+class LocationLoader:
+    def __init__(self, config, manifest=None):
+        self.config = config
+        self.manifest = manifest
+
+    def load(self, location_files):
+        config, manifest = self.config, self.manifest
+        if manifest is None:
+            location_lookup = LocationTable()
+            for file in tqdm(prefetch_files(location_files, config.readahead_mb),
+                             total=len(location_files), desc="Loading Locations"):
+                load_location_file(file, location_lookup, config.json_backend)
+            return location_lookup
+
+        # Persistent SQLite index: only new/changed Location files are parsed,
+        # and enrichment queries just the locations Encounters reference
+        if not config.location_index.exists():
+            manifest.reset("Location")
+        location_lookup = LocationIndex(config.location_index)
+        location_todo, removed = manifest.plan("Location", location_files)
+        for entry in removed:
+            location_lookup.remove_file(entry["key"])
+        for file in tqdm(prefetch_files(location_todo, config.readahead_mb),
+                         total=len(location_todo), desc="Loading Locations"):
+            location_lookup.replace_file(manifest.key(file),
+                                         load_location_file(file, backend=config.json_backend))
+            manifest.commit(file)
+        return location_lookup
+
+# STEP 4-5: Extract Practitioner data into batch files (or spill partitions)
+class PractitionerExtractor:
+    def __init__(self, config, manifest=None):
+        self.config = config
+        self.manifest = manifest
+        # Names of the batch files written by this run
+        self.rewritten_batches = set()
+
+    def _shards(self, practitioner_files):
+        config, manifest = self.config, self.manifest
+        options = (config.batch_dir, config.batch_size, config.json_backend, config.readahead_mb)
+        if manifest is not None:
+            # One shard per new/changed file, numbered by its manifest id
+            practitioner_todo, removed = manifest.plan("Practitioner", practitioner_files)
+            for entry in removed:
+                for name in entry["batches"]:
+                    (config.batch_dir / name).unlink(missing_ok=True)
+            shards = []
+            for file in practitioner_todo:
+                shard = manifest.file_id(file)
+                for stale in config.batch_dir.glob(f"practitioner_batch_{shard:04d}_*.parquet"):
+                    stale.unlink()
+                shards.append((shard, [file], *options))
+            return shards
+        if config.practitioner_workers > 1:
+            # Each worker owns a contiguous run of files (or byte ranges) and writes its own
+            # practitioner_batch_<shard>_<batch>.parquet files; the parent only counts
+            return [(shard, files, *options)
+                    for shard, files in enumerate(file_chunks(
+                        split_ndjson_files(practitioner_files, config.split_file_mb),
+                        config.practitioner_workers))]
+        return [(None, practitioner_files, *options)]
+
+    # Write batch files; returns (batches written, practitioners written)
+    def extract(self, practitioner_files):
+        self.config.batch_dir.mkdir(parents=True, exist_ok=True)
+        shards = self._shards(practitioner_files)
+        batch_count = practitioner_count = 0
+        for (shard, files, *_), (shard_batches, shard_rows) in tqdm(
+            zip(shards, run_tasks(extract_practitioner_shard, shards, self.config.practitioner_workers)),
+            total=len(shards), desc="Parsing Practitioners"
+        ):
+            batch_count += shard_batches
+            practitioner_count += shard_rows
+            names = [batch_file_name(n, shard) for n in range(shard_batches)]
+            self.rewritten_batches.update(names)
+            if self.manifest is not None:
+                self.manifest.commit(files[0], batches=names)
+        print(f"✅ Wrote {practitioner_count:,} practitioners in {batch_count} batch file(s)")
+        return batch_count, practitioner_count
+
+    # Spill Practitioner rows into the hash partitions (activity_partitions mode)
+    def spill(self, practitioner_files):
+        config = self.config
+        buffer_rows = config.spill_memory_mb * 2**20 // SPILL_ROW_BYTES // max(config.practitioner_workers, 1)
+        spills = [
+            (chunk, files, config.spill_dir, config.activity_partitions, buffer_rows,
+             config.json_backend, config.readahead_mb)
+            for chunk, files in enumerate(file_chunks(
+                split_ndjson_files(practitioner_files, config.split_file_mb), config.practitioner_workers))
+        ]
+        return sum(tqdm(run_tasks(spill_practitioner_files, spills, config.practitioner_workers),
+                        total=len(spills), desc="Spilling Practitioners"))
+
+# STEP 6: Process Encounters and track min/max activity per provider
+class EncounterActivityReducer:
+    def __init__(self, config, manifest=None, location_lookup=None):
+        self.config = config
+        self.manifest = manifest
+        # The STEP 3 LocationTable, when there is one, is shared with in-process reductions
+        self.locations = location_lookup if isinstance(location_lookup, LocationTable) else None
+
+    def reduce(self, encounter_files):
+        config, manifest = self.config, self.manifest
+        activity_map = ActivityStore()
+        if manifest is not None:
+            # Each new/changed file is reduced into its own persisted ActivityStore;
+            # the stores of all current files are then merged in file order
+            encounter_todo, removed = manifest.plan("Encounter", encounter_files)
+            for entry in removed:
+                manifest.state_file("Encounter", entry["id"]).unlink(missing_ok=True)
+            tasks = [
+                (file, manifest.state_file("Encounter", manifest.file_id(file)),
+                 config.json_backend, config.encounter_projection, config.readahead_mb)
+                for file in encounter_todo
+            ]
+            for file in tqdm(run_tasks(reduce_encounter_file_to_state, tasks, config.encounter_workers),
+                             total=len(tasks), desc="Parsing Encounters"):
+                manifest.commit(file)
+            for file in tqdm(encounter_files, desc="Merging Encounter state"):
+                activity_map.merge(load_state(manifest.state_file("Encounter", manifest.file_id(file))))
+            return activity_map
+
+        # Each worker reduces a contiguous run of files; merging the runs in order
+        # gives the same first/last picks as the single-process scan
+        chunks = file_chunks(split_ndjson_files(encounter_files, config.split_file_mb),
+                             config.encounter_workers)
+        # A run reduced in this process interns its location references straight into the
+        # STEP 3 table (its codes are then address indexes); worker runs are remapped on merge
+        in_process = config.encounter_workers <= 1 or len(chunks) <= 1
+        reduce_chunk = partial(reduce_encounter_files, backend=config.json_backend,
+                               projection=config.encounter_projection, readahead_mb=config.readahead_mb,
+                               locations=self.locations if in_process else None)
+        for partial_map in tqdm(run_tasks(reduce_chunk, chunks, config.encounter_workers),
+                                total=len(chunks), desc="Parsing Encounters"):
+            activity_map = activity_map.merge(partial_map) if len(activity_map) else partial_map
+        return activity_map
+
+    # Spill Encounter participations into the hash partitions (activity_partitions mode)
+    def spill(self, encounter_files):
+        config = self.config
+        buffer_rows = config.spill_memory_mb * 2**20 // SPILL_ROW_BYTES // max(config.encounter_workers, 1)
+        spills = [
+            (chunk, files, config.spill_dir, config.activity_partitions, buffer_rows,
+             config.json_backend, config.encounter_projection, config.readahead_mb)
+            for chunk, files in enumerate(file_chunks(
+                split_ndjson_files(encounter_files, config.split_file_mb), config.encounter_workers))
+        ]
+        return sum(tqdm(run_tasks(spill_encounter_files, spills, config.encounter_workers),
+                        total=len(spills), desc="Spilling Encounters"))
+
+# STEP 7: Enrich practitioners with activity data and write the final CSV (and Parquet)
+class Enricher:
+    def __init__(self, config, location_lookup, manifest=None):
+        self.config = config
+        self.location_lookup = location_lookup
+        self.manifest = manifest
+        self.parquet_writer = None
+        self.row_count = 0
+        self.duplicate_count = 0
+
+    def open(self):
+        config = self.config
+        # Clear final output if exists
+        if config.final_output.exists():
+            config.final_output.unlink()
+        if config.final_output_parquet:
+            self.parquet_writer = pq.ParquetWriter(config.final_output_parquet, PRACTITIONER_SCHEMA)
+        self.row_count = 0
+        self.duplicate_count = 0
+
+    def append(self, df):
+        append_final_output(df, self.config.final_output, self.parquet_writer)
+        self.row_count += len(df)
+
+    def close(self):
+        if self.duplicate_count:
+            print(f"🧹 Dropped {self.duplicate_count:,} duplicate provider_id row(s) "
+                  f"(kept the {self.config.dedup} one)")
+        if self.parquet_writer:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+            print(f"🎉 Final Parquet output written to {self.config.final_output_parquet}")
+        print(f"🎉 Final output written to {self.config.final_output}")
+
+    def activity_frame(self, activity_map):
+        return activity_frame(activity_map, self.location_lookup)
+
+    # Single pass: flatten, enrich and append each practitioner batch as soon as it is parsed
+    def enrich_practitioner_files(self, practitioner_files, activity_df):
+        config = self.config
+        seen = SeenProviders()
+        for batch in iter_practitioner_batches(
+            tqdm(prefetch_files(practitioner_files, config.readahead_mb), total=len(practitioner_files),
+                 desc="Parsing and Enriching Practitioners"),
+            config.batch_size, config.json_backend
+        ):
+            # Drop provider_ids already written, from an earlier batch or earlier in this one
+            keep = seen.first_seen(batch.column("provider_id").to_numpy(zero_copy_only=False))
+            self.duplicate_count += int((~keep).sum())
+            self.append(enrich_batch(batch_frame(batch.filter(keep)), activity_df))
+        print(f"✅ Wrote {self.row_count:,} enriched practitioners to final output")
+
+    # Reduce each spilled Encounter partition and join it with the matching Practitioner partition
+    def enrich_partitions(self):
+        config = self.config
+        for partition in tqdm(range(config.activity_partitions), desc="Reducing and Enriching Partitions"):
+            partition_activity = self.activity_frame(reduce_spilled_partition(config.spill_dir, partition))
+            df = enrich_batch(read_practitioner_partition(config.spill_dir, partition), partition_activity)
+            # Every row of a provider_id lands in one partition, so this dedup is global
+            deduplicated = dedup_frame(df, config.dedup, SCORED_FIELDS)
+            self.duplicate_count += len(df) - len(deduplicated)
+            self.append(deduplicated)
+
+    # Index the provider_ids of every batch file and resolve which rows are kept, so a
+    # practitioner repeated across batches is written once; returns one mask per batch
+    def keep_masks(self, batch_files):
+        complete = self.config.dedup == "complete"
+        index = ProviderIndex(self.config.dedup)
+        for batch_file in tqdm(batch_files, desc="Indexing provider_ids"):
+            table = pq.read_table(batch_file, columns=PRACTITIONER_FIELDS if complete else ["provider_id"])
+            scores = frame_completeness(table.to_pandas(), SCORED_FIELDS) if complete else None
+            index.add(table.column("provider_id").to_numpy(zero_copy_only=False), scores)
+        return index.keep_masks()
+
+    # Enrich the batch files in order. In incremental runs, batches that were not
+    # rewritten and hold no provider whose activity changed reuse their enriched copy
+    # from the last run; returns how many were reused
+    def enrich_batches(self, batch_files, activity_df, rewritten_batches=()):
+        config = self.config
+        changed = None
+        if self.manifest is not None:
+            changed = (changed_providers(pd.read_parquet(config.activity_state), activity_df)
+                       if config.activity_state.exists() else None)
+            config.enriched_dir.mkdir(exist_ok=True)
+            current = {batch_file.name for batch_file in batch_files}
+            for stale in config.enriched_dir.glob("practitioner_batch_*.parquet"):
+                if stale.name not in current:
+                    stale.unlink()
+
+        reused_batches = 0
+        keep_masks = self.keep_masks(batch_files)
+        for batch_file, keep in tqdm(zip(batch_files, keep_masks), total=len(batch_files),
+                                     desc="Merging and Enriching Batches"):
+            enriched_file = config.enriched_dir / batch_file.name
+            if (changed is not None and batch_file.name not in rewritten_batches
+                    and enriched_file.exists()
+                    and changed.isdisjoint(pq.read_table(batch_file, columns=["provider_id"])
+                                           .column(0).to_pylist())):
+                df = read_batch(enriched_file)
+                reused_batches += 1
+            else:
+                df = read_batch(batch_file)
+
+                # Vectorized enrichment: one hash join against the prebuilt activity table
+                df = enrich_batch(df, activity_df)
+
+                if self.manifest is not None:
+                    pq.write_table(pa.Table.from_pandas(df, schema=PRACTITIONER_SCHEMA,
+                                                        preserve_index=False), enriched_file)
+
+            # Append enriched batch to final output, minus provider_ids kept from another row
+            # (the enriched copy keeps every row, as the masks depend on the other batches)
+            self.duplicate_count += int((~keep).sum())
+            self.append(df[keep])
+            print(f"✅ Appended enriched batch {batch_file.name} to final output")
+        return reused_batches
+
+# Run every step for one config; returns the run's metrics report
+def run_pipeline(config):
+    config.validate()
+    config.output_dir.mkdir(parents=True, exist_ok=True)
+    metrics = RunMetrics(config.profile_dir)
+    try:
+        return _run_steps(config, metrics)
+    finally:
+        metrics.close()
+
+# Helper: The steps of run_pipeline, with metrics recorded per stage
+def _run_steps(config, metrics):
+
+    # STEP 1.5: Paranoid mode - abort if batches already exist
+    # (incremental reruns own their batches through the manifest)
+    manifest = Manifest(config.state_dir, config.fhir_root) if config.incremental else None
+    existing_batches = list(config.batch_dir.glob("practitioner_batch_*.*"))
+    if existing_batches and not (manifest and manifest.path.exists()):
+        raise RuntimeError(
+            f"🚨 Found {len(existing_batches)} existing batch file(s) in {config.batch_dir}. "
+            "Delete or move them before rerunning to avoid overwriting."
+        )
+
+    # STEP 2: Gather all necessary file paths (.ndjson, or compressed .ndjson.gz/.bz2/.zst)
+    practitioner_files = find_ndjson_files(config.fhir_root / "Practitioner")
+    encounter_files = find_ndjson_files(config.fhir_root / "Encounter")
+    location_files = find_ndjson_files(config.fhir_root / "Location")
+    check_codecs(practitioner_files + encounter_files + location_files)
+
+    # STEP 3-7 (Dask mode): the Dask graph covers every remaining step
+    if config.dask_mode:
+        # Imported here so runs without Dask do not pay for importing it
+        from FHIR_Dask import dask_client, run_dask_pipeline
+        if config.dask_output_dir.exists():
+            shutil.rmtree(config.dask_output_dir)
+        with dask_client(config.dask_scheduler, config.encounter_workers) as client:
+            print(f"🚀 Running on Dask cluster {client.dashboard_link}")
+            row_count = run_dask_pipeline(location_files, practitioner_files, encounter_files,
+                                          config.dask_output_dir, config.json_backend,
+                                          config.encounter_projection, config.dedup)
+        print(f"🎉 Wrote {row_count:,} enriched practitioners to {config.dask_output_dir}")
+        metrics.mark("dask")
+        metrics.save(config.run_report)
+        print(f"📊 Run metrics written to {config.run_report}")
+        return metrics.report()
+
+    metrics.mark("setup")
+
+    # STEP 3
+    location_lookup = LocationLoader(config, manifest).load(location_files)
+    metrics.mark("location_load")
+
+    # STEP 4-5 (single-pass and spill modes read Practitioners in STEP 6-7)
+    extractor = PractitionerExtractor(config, manifest)
+    if config.batched:
+        extractor.extract(practitioner_files)
+    metrics.mark("practitioner_parse")
+
+    # STEP 6
+    reducer = EncounterActivityReducer(config, manifest, location_lookup)
+    if config.activity_partitions:
+        # Spill Encounter participations and Practitioner rows into hash partitions;
+        # they are reduced and joined one partition at a time in STEP 7
+        if config.spill_dir.exists():
+            shutil.rmtree(config.spill_dir)
+        config.spill_dir.mkdir()
+        spilled = reducer.spill(encounter_files)
+        practitioner_count = extractor.spill(practitioner_files)
+        print(f"✅ Spilled {spilled:,} participations and {practitioner_count:,} practitioners "
+              f"into {config.activity_partitions} partition(s)")
+        activity_df = activity_frame(ActivityStore(), location_lookup)
+    elif config.engine == "duckdb":
+        # DuckDB runs the GROUP BY and the Location join itself
+        activity_df = duckdb_activity_frame(encounter_files, location_lookup, config.encounter_workers)
+    else:
+        activity_df = activity_frame(reducer.reduce(encounter_files), location_lookup)
+    metrics.mark("encounter_scan")
+
+    # STEP 7
+    enricher = Enricher(config, location_lookup, manifest)
+    enricher.open()
+    if config.single_pass:
+        enricher.enrich_practitioner_files(practitioner_files, activity_df)
+    elif config.activity_partitions:
+        enricher.enrich_partitions()
+        shutil.rmtree(config.spill_dir)
+    elif manifest is not None:
+        # Batches in practitioner file order, as recorded in the manifest
+        batch_files = [config.batch_dir / name for file in practitioner_files
+                       for name in manifest.entry(file)["batches"]]
+        reused_batches = enricher.enrich_batches(batch_files, activity_df, extractor.rewritten_batches)
+    else:
+        enricher.enrich_batches(sorted(config.batch_dir.glob("practitioner_batch_*.parquet")), activity_df)
+    enricher.close()
+
+    if manifest is not None:
+        # Persist state last, so an interrupted run is simply redone next time
+        activity_df.to_parquet(config.activity_state)
+        manifest.save()
+        location_lookup.close()
+        print(f"♻️ Reused {reused_batches} of {len(batch_files)} enriched batch(es); "
+              f"state saved to {config.state_dir}")
+    metrics.mark("merge_enrich")
+    metrics.save(config.run_report)
+    print(f"📊 Run metrics written to {config.run_report}")
+    return metrics.report()
+
+# Command line: every PipelineConfig setting as a flag (defaults match PipelineConfig)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Flatten FHIR Practitioner NDJSON and enrich it with first/last Encounter activity")
+    parser.add_argument("--input", type=Path, default=DEFAULT_FHIR_ROOT,
+                        help="FHIR export root holding Practitioner/, Encounter/ and Location/ "
+                             f"(default: {DEFAULT_FHIR_ROOT})")
+    parser.add_argument("--output", type=Path,
+                        help="output directory (default: FHIR_Processed next to --input)")
+    parser.add_argument("--batch-size", type=int, default=100_000, help="practitioners per batch file")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count; 1 = in-process)")
+    parser.add_argument("--incremental", action=argparse.BooleanOptionalAction,
+                        help="only re-parse new or changed files, using state kept in the output directory "
+                             "(default: on, except with --single-pass, --activity-partitions, --dask "
+                             "or --engine duckdb, which cannot use it)")
+    parser.add_argument("--single-pass", action="store_true", help="stream practitioners without batch files")
+    parser.add_argument("--activity-partitions", type=int, default=0,
+                        help="spill to N on-disk hash partitions (0 = in memory)")
+    parser.add_argument("--spill-memory-mb", type=int, default=512)
+    parser.add_argument("--dask", action="store_true", help="run as a Dask graph")
+    parser.add_argument("--dask-scheduler", help="Dask scheduler address (default: a LocalCluster)")
+    parser.add_argument("--engine", choices=["python", "duckdb"], default="python",
+                        help="Encounter aggregation engine (duckdb needs the duckdb package)")
+    parser.add_argument("--json-backend", choices=["orjson", "json", "simdjson"])
+    parser.add_argument("--encounter-projection", action="store_true",
+                        help="read Encounters through the ijson field projection")
+    parser.add_argument("--readahead-mb", type=int, default=64, help="background readahead (0 = off)")
+    parser.add_argument("--split-file-mb", type=int, default=256,
+                        help="split uncompressed shards larger than this across workers (0 = never)")
+    parser.add_argument("--dedup", choices=list(DEDUP_POLICIES),
+                        help="which row of a repeated provider_id to keep: first, last or complete "
+                             "(most non-empty fields) (default: last; first with --single-pass)")
+    parser.add_argument("--no-parquet", action="store_true", help="write the final table as CSV only")
+    parser.add_argument("--profile", action="store_true",
+                        help="cProfile every stage into <output>/profile/<stage>.pstats")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = PipelineConfig(
+        fhir_root=args.input, output_dir=args.output, batch_size=args.batch_size, workers=args.workers,
+        incremental=args.incremental,
+        single_pass=args.single_pass, activity_partitions=args.activity_partitions,
+        spill_memory_mb=args.spill_memory_mb, dask_mode=args.dask, dask_scheduler=args.dask_scheduler,
+        json_backend=args.json_backend, encounter_projection=args.encounter_projection,
+        readahead_mb=args.readahead_mb, split_file_mb=args.split_file_mb,
+        write_parquet=not args.no_parquet, profile=args.profile, engine=args.engine, dedup=args.dedup
+    )
+    run_pipeline(config)
+    return 0
@@ -0,0 +1,157 @@
+import time
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.parquet as pq
+from NDJSON_Decoding import iter_ndjson
+from NDJSON_IO import prefetch_files
+from FHIR_Metrics import COUNTERS
+
+# Explicit column types for practitioner batches and the final table, so nothing
+# is ever type-inferred (NPIs and numeric-looking ids stay strings)
+# The first PRACTITIONER_FIELDS come from the Practitioner resource; the activity
+# columns are filled in during enrichment
+PRACTITIONER_FIELDS = ["provider_id", "npi", "name", "phone", "email", "address", "organization"]
+PRACTITIONER_COLUMNS = PRACTITIONER_FIELDS + [
+    "first_activity_date", "first_activity_location", "first_activity_address",
+    "last_activity_date", "last_activity_location", "last_activity_address"
+]
+PRACTITIONER_SCHEMA = pa.schema([(column, pa.string()) for column in PRACTITIONER_COLUMNS])
+
+# Activity placeholders appended to a flattened row to make it a full PRACTITIONER_SCHEMA row
+NO_ACTIVITY = (None,) * (len(PRACTITIONER_COLUMNS) - len(PRACTITIONER_FIELDS))
+
+# Helper: Flatten one Practitioner resource into a tuple of PRACTITIONER_FIELDS (None if it has no id)
+def flatten_practitioner(rec):
+    pid = rec.get("id")
+    if not pid:
+        return None
+
+    # ✅ Safer name parsing
+    name_entry = (rec.get("name") or [{}])[0]
+    prefix = " ".join(name_entry.get("prefix", []))
+    given = " ".join(name_entry.get("given", []))
+    family = name_entry.get("family", "")
+    full_name = " ".join(filter(None, [prefix, given, family])).strip() or "Unknown Provider"
+
+    # Telecom
+    phone = email = None
+    for telecom in rec.get("telecom", []):
+        if telecom.get("system") == "phone":
+            phone = telecom.get("value")
+        elif telecom.get("system") == "email":
+            email = telecom.get("value")
+
+    # Address
+    address_entry = (rec.get("address") or [{}])[0]
+    address = ", ".join(filter(None, [
+        " ".join(address_entry.get("line", [])),
+        address_entry.get("city"),
+        address_entry.get("state"),
+        address_entry.get("postalCode"),
+        address_entry.get("country")
+    ])).strip()
+
+    # Organization reference
+    organization = rec.get("organization", {}).get("reference")
+
+    npi = next((i['value'] for i in rec.get("identifier", [])
+                if i.get("system", "").lower().endswith("npi")), None)
+
+    return (pid, npi, full_name, phone, email, address, organization)
+
+# Fields counted by the "complete" dedup policy
+SCORED_FIELDS = PRACTITIONER_FIELDS[1:]
+
+# Accumulates flattened rows straight into per-column lists and emits them as one Arrow
+# RecordBatch, so a batch never holds a dict per row. Every row is kept: duplicate
+# provider_ids are resolved at enrichment time, under the policy of that run (see FHIR_Dedup)
+class PractitionerBatchBuilder:
+    def __init__(self):
+        self.columns = [[] for _ in PRACTITIONER_FIELDS]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+
+    # Build the RecordBatch (activity columns all null) and start a new, empty batch
+    def finish(self):
+        rows = len(self)
+        arrays = [pa.array(column, type=pa.string()) for column in self.columns]
+        arrays += [pa.nulls(rows, type=pa.string()) for _ in NO_ACTIVITY]
+        self.columns = [[] for _ in PRACTITIONER_FIELDS]
+        return pa.RecordBatch.from_arrays(arrays, schema=PRACTITIONER_SCHEMA)
+
+# Helper: Read a batch back with the explicit schema (no type inference)
+def read_batch(batch_file):
+    return pq.read_table(batch_file, schema=PRACTITIONER_SCHEMA).to_pandas()
+
+# Helper: Yield flattened Practitioner rows (PRACTITIONER_FIELDS tuples) from one NDJSON file
+def iter_practitioners(file, backend=None):
+    for rec in iter_ndjson(file, backend):
+        row = flatten_practitioner(rec)
+        if row is not None:
+            yield row
+
+# Helper: Batch file name
+# Worker shards put their shard number ahead of the batch number so names never collide
+def batch_file_name(batch_num, shard=None):
+    if shard is None:
+        return f"practitioner_batch_{batch_num:04d}.parquet"
+    return f"practitioner_batch_{shard:04d}_{batch_num:04d}.parquet"
+
+# Helper: Write a batch to Parquet
+def write_batch(batch, batch_num, batch_dir, shard=None):
+    started = time.perf_counter()
+    batch_file = Path(batch_dir) / batch_file_name(batch_num, shard)
+    pq.write_table(pa.Table.from_batches([batch]), batch_file)
+    COUNTERS["batches_written"] += 1
+    COUNTERS["batch_write_seconds"] += time.perf_counter() - started
+    print(f"✅ Wrote batch {batch_num} to {batch_file}")
+
+# Helper: Yield batches of flattened rows as Arrow RecordBatches
+def iter_practitioner_batches(files, batch_size, backend=None):
+    builder = PractitionerBatchBuilder()
+
+    for file in files:
+        for row in iter_practitioners(file, backend):
+            builder.append(row)
+
+            # ✅ Emit batch if threshold reached
+            if len(builder) >= batch_size:
+                yield builder.finish()
+
+    # Emit any remaining records
+    if len(builder):
+        yield builder.finish()
+
+# Helper: Turn a batch into a DataFrame with the explicit schema
+def batch_frame(batch):
+    return batch.to_pandas()
+
+# Extract Practitioner files into batch files; returns (batches written, rows written)
+def extract_practitioner_files(files, batch_dir, batch_size, shard=None, backend=None):
+    batch_count = 0
+    row_count = 0
+    for batch in iter_practitioner_batches(files, batch_size, backend):
+        write_batch(batch, batch_count, batch_dir, shard)
+        row_count += batch.num_rows
+        batch_count += 1
+    return batch_count, row_count
+
+# Helper: Append an enriched frame to the final CSV (and Parquet writer, if any)
+def append_final_output(df, final_output, parquet_writer=None):
+    header = not final_output.exists()
+    df.to_csv(final_output, mode="a", index=False, header=header)
+    if parquet_writer:
+        parquet_writer.write_table(
+            pa.Table.from_pandas(df, schema=PRACTITIONER_SCHEMA, preserve_index=False)
+        )
+
+# Worker entry point: args is (shard, files, batch_dir, batch_size, backend, readahead_mb)
+def extract_practitioner_shard(args):
+    shard, files, batch_dir, batch_size, backend, readahead_mb = args
+    return extract_practitioner_files(prefetch_files(files, readahead_mb), batch_dir, batch_size,
+                                      shard, backend)
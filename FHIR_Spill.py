@@ -0,0 +1,151 @@
+import zlib
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from FHIR_Helpers import normalize_location_key, activity_sort_key
+from FHIR_Activity import NO_FIRST, NO_LAST, NO_LOCATION, ActivityStore, iter_encounter_fields
+from FHIR_Practitioners import PRACTITIONER_SCHEMA, NO_ACTIVITY, iter_practitioners
+from NDJSON_IO import prefetch_files
+
+# External (spill-to-disk) aggregation for registries whose practitioners do not fit in RAM.
+# Encounter participations and Practitioner rows are hash-partitioned on provider_id into
+# N Arrow IPC files each; every partition is then reduced and joined on its own, so peak
+# memory is one partition's ActivityStore plus its practitioners.
+
+ENCOUNTER_SPILL_SCHEMA = pa.schema([
+    ("provider_id", pa.string()),
+    ("start", pa.string()),
+    ("start_key", pa.int64()),
+    ("end", pa.string()),
+    ("end_key", pa.int64()),
+    ("location", pa.string())
+])
+
+# Rough in-memory size of one buffered row, used to turn a memory budget into a row count
+SPILL_ROW_BYTES = 256
+
+# Helper: Stable partition for a provider_id (the built-in hash() differs between processes)
+def partition_of(pid, partitions):
+    return zlib.crc32(pid.encode("utf-8")) % partitions
+
+# Buffers rows per partition and appends them to <spill_dir>/<prefix>_<partition>_<chunk>.arrow
+# whenever the buffered row count reaches buffer_rows
+class PartitionSpiller:
+    def __init__(self, spill_dir, prefix, schema, partitions, chunk, buffer_rows):
+        self.spill_dir = Path(spill_dir)
+        self.prefix = prefix
+        self.schema = schema
+        self.chunk = chunk
+        self.buffer_rows = max(1, buffer_rows)
+        self.buffers = [[] for _ in range(partitions)]
+        self.writers = [None] * partitions
+        self.buffered = 0
+
+    def add(self, partition, row):
+        self.buffers[partition].append(row)
+        self.buffered += 1
+        if self.buffered >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        for partition, rows in enumerate(self.buffers):
+            if not rows:
+                continue
+            if self.writers[partition] is None:
+                path = self.spill_dir / spill_file_name(self.prefix, partition, self.chunk)
+                self.writers[partition] = pa.ipc.new_stream(str(path), self.schema)
+            columns = list(zip(*rows))
+            self.writers[partition].write_batch(pa.record_batch(
+                [pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+                schema=self.schema
+            ))
+            rows.clear()
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        for writer in self.writers:
+            if writer is not None:
+                writer.close()
+
+def spill_file_name(prefix, partition, chunk):
+    return f"{prefix}_{partition:04d}_{chunk:04d}.arrow"
+
+# Helper: All spill files of one partition, in chunk (= input file) order
+def spill_files(spill_dir, prefix, partition):
+    return sorted(Path(spill_dir).glob(f"{prefix}_{partition:04d}_*.arrow"))
+
+def _read_spill(paths):
+    for path in paths:
+        with pa.ipc.open_stream(str(path)) as reader:
+            yield from reader
+
+# Worker entry point: spill one contiguous run of Encounter files
+# args is (chunk, files, spill_dir, partitions, buffer_rows, backend, projection, readahead_mb)
+def spill_encounter_files(args):
+    chunk, files, spill_dir, partitions, buffer_rows, backend, projection, readahead_mb = args
+    spiller = PartitionSpiller(spill_dir, "encounter", ENCOUNTER_SPILL_SCHEMA,
+                               partitions, chunk, buffer_rows)
+    row_count = 0
+    # Each distinct raw location reference is normalized once
+    normalize = lru_cache(maxsize=2**16)(normalize_location_key)
+    for file in prefetch_files(files, readahead_mb):
+        for start, end, loc_ref, actor_refs in iter_encounter_fields(file, backend, projection):
+            if not start and not end:
+                print(f"⚠️ Encounter missing period dates in file {file}")
+                continue
+
+            loc_ref = normalize(loc_ref)
+            start_key = activity_sort_key(start) if start else None
+            end_key = activity_sort_key(end) if end else None
+
+            for actor_ref in actor_refs:
+                if actor_ref.startswith("Practitioner/"):
+                    pid = actor_ref.split("/")[-1]
+                    if not pid:
+                        continue
+                    spiller.add(partition_of(pid, partitions),
+                                (pid, start, start_key, end, end_key, loc_ref))
+                    row_count += 1
+    spiller.close()
+    return row_count
+
+# Worker entry point: spill one contiguous run of Practitioner files
+# args is (chunk, files, spill_dir, partitions, buffer_rows, backend, readahead_mb)
+def spill_practitioner_files(args):
+    chunk, files, spill_dir, partitions, buffer_rows, backend, readahead_mb = args
+    spiller = PartitionSpiller(spill_dir, "practitioner", PRACTITIONER_SCHEMA,
+                               partitions, chunk, buffer_rows)
+    row_count = 0
+    for file in prefetch_files(files, readahead_mb):
+        for row in iter_practitioners(file, backend):
+            spiller.add(partition_of(row[0], partitions), row + NO_ACTIVITY)
+            row_count += 1
+    spiller.close()
+    return row_count
+
+# Reduce one Encounter partition into an ActivityStore (same first/last rules, same order),
+# one vectorized fold per spilled record batch
+def reduce_spilled_partition(spill_dir, partition):
+    activity_map = ActivityStore()
+    for batch in _read_spill(spill_files(spill_dir, "encounter", partition)):
+        pid_codes, pids = pd.factorize(batch.column("provider_id").to_numpy(zero_copy_only=False))
+        location_codes, loc_refs = pd.factorize(batch.column("location").to_numpy(zero_copy_only=False))
+        activity_map.update_many(
+            activity_map.slots_of(pids)[pid_codes],
+            batch.column("start").to_numpy(zero_copy_only=False),
+            batch.column("start_key").fill_null(NO_FIRST).to_numpy(),
+            batch.column("end").to_numpy(zero_copy_only=False),
+            batch.column("end_key").fill_null(NO_LAST).to_numpy(),
+            # factorize codes a missing location as -1, which picks up the trailing NO_LOCATION
+            np.array([activity_map.location_code(ref) for ref in loc_refs] + [NO_LOCATION],
+                     dtype=np.int32)[location_codes]
+        )
+    return activity_map
+
+# Read one Practitioner partition back as a DataFrame (explicit schema)
+def read_practitioner_partition(spill_dir, partition):
+    batches = list(_read_spill(spill_files(spill_dir, "practitioner", partition)))
+    return pa.Table.from_batches(batches, schema=PRACTITIONER_SCHEMA).to_pandas()
@@ -0,0 +1,180 @@
+import random
+from pathlib import Path
+import orjson
+
+# Synthetic FHIR Practitioner / Encounter / Location records for benchmarking.
+# Shapes follow what the pipeline reads, plus the kind of bulk we skip over
+# (extensions, identifiers, text narratives) so decode costs are realistic.
+
+_GIVEN = ["Ann", "Ben", "Carla", "Dev", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jon"]
+_FAMILY = ["Smith", "Nguyen", "Garcia", "Okafor", "Kowalski", "Haddad", "Silva", "Chen", "Moore"]
+_CITIES = [("Bethesda", "MD", "20814"), ("Austin", "TX", "73301"), ("Denver", "CO", "80202"),
+           ("Columbus", "OH", "43004"), ("Portland", "OR", "97201")]
+
+def _address(rng):
+    city, state, postal = rng.choice(_CITIES)
+    return {
+        "use": "work",
+        "line": [f"{rng.randint(1, 9999)} {rng.choice(_FAMILY)} Ave", f"Suite {rng.randint(1, 500)}"],
+        "city": city,
+        "state": state,
+        "postalCode": postal,
+        "country": "US"
+    }
+
+def _instant(rng, year_from=2015, year_to=2024):
+    year = rng.randint(year_from, year_to)
+    stamp = (f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+             f"T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}")
+    return stamp + rng.choice(["Z", "-05:00", "-08:00", ".250+00:00"])
+
+def practitioner_record(rng, index):
+    return {
+        "resourceType": "Practitioner",
+        "id": f"prac-{index}",
+        "meta": {"lastUpdated": _instant(rng), "profile": [
+            "http://hl7.org/fhir/us/core/StructureDefinition/us-core-practitioner"]},
+        "identifier": [
+            {"system": "http://hl7.org/fhir/sid/us-npi", "value": str(1_000_000_000 + index)},
+            {"system": "urn:oid:2.16.840.1.113883.4.4", "value": f"{rng.randint(0, 10**9):09d}"}
+        ],
+        "active": True,
+        "name": [{"use": "official", "prefix": ["Dr."], "given": [rng.choice(_GIVEN)],
+                  "family": rng.choice(_FAMILY)}],
+        "telecom": [
+            {"system": "phone", "value": f"555-{rng.randint(0, 9999):04d}", "use": "work"},
+            {"system": "email", "value": f"prac{index}@example.org", "use": "work"}
+        ],
+        "address": [_address(rng)],
+        "organization": {"reference": f"Organization/org-{rng.randint(0, 999)}"},
+        "qualification": [{"code": {"text": "DPM"}, "period": {"start": _instant(rng, 1990, 2014)}}]
+    }
+
+def location_record(rng, index):
+    return {
+        "resourceType": "Location",
+        "id": f"loc-{index}",
+        "status": "active",
+        "name": f"{rng.choice(_FAMILY)} Podiatry Clinic {index}",
+        "telecom": [{"system": "phone", "value": f"555-{rng.randint(0, 9999):04d}"}],
+        "address": _address(rng),
+        "position": {"longitude": rng.uniform(-124, -67), "latitude": rng.uniform(25, 49)}
+    }
+
+def encounter_record(rng, index, practitioner_count, location_count, participants=2):
+    start = _instant(rng)
+    return {
+        "resourceType": "Encounter",
+        "id": f"enc-{index}",
+        "status": "finished",
+        "class": {"system": "http://terminology.hl7.org/CodeSystem/v3-ActCode", "code": "AMB"},
+        "type": [{"coding": [{"system": "http://www.ama-assn.org/go/cpt", "code": "99213",
+                              "display": "Office or other outpatient visit"}]}],
+        "subject": {"reference": f"Patient/pat-{rng.randint(0, 10**7)}"},
+        "participant": [
+            {"type": [{"coding": [{"code": "PPRF"}]}],
+             "individual": {"reference": f"Practitioner/prac-{rng.randrange(practitioner_count)}"}}
+            for _ in range(participants)
+        ],
+        "period": {"start": start, "end": start},
+        "reasonCode": [{"coding": [{"system": "http://snomed.info/sct", "code": "271807003"}],
+                        "text": "Plantar fasciitis follow-up"}],
+        "location": [{"location": {"reference": f"Location/loc-{rng.randrange(location_count)}"}}],
+        "text": {"status": "generated", "div": "<div>" + "Encounter narrative. " * 20 + "</div>"}
+    }
+
+# Helper: Write NDJSON lines for one resource type as <root>/<type>/export/<type>_NNNN.ndjson,
+# shard_records lines per file. A corrupt_rate fraction of lines is cut in half (bad JSON).
+def _write_shards(root, resource_type, records, shard_records, corrupt_rate, rng):
+    export_dir = root / resource_type / "export"
+    export_dir.mkdir(parents=True, exist_ok=True)
+    stats = {"records": 0, "corrupt": 0, "files": 0, "bytes": 0}
+    f = None
+    for i, rec in enumerate(records):
+        if i % shard_records == 0:
+            if f:
+                f.close()
+            f = open(export_dir / f"{resource_type}_{stats['files']:04d}.ndjson", 'wb')
+            stats["files"] += 1
+        line = orjson.dumps(rec)
+        if corrupt_rate and rng.random() < corrupt_rate:
+            line = line[:len(line) // 2]
+            stats["corrupt"] += 1
+        else:
+            stats["records"] += 1
+        f.write(line + b"\n")
+        stats["bytes"] += len(line) + 1
+    if f:
+        f.close()
+    return stats
+
+# Write a synthetic FHIR Bulk Data export under root, laid out like XRegistry
+# (<root>/<resource type>/<export>/*.ndjson). Returns per-type counts:
+# {type: {"records", "corrupt", "files", "bytes"}}
+def write_bulk_export(root, practitioners, encounters_per_practitioner=5, participants=2,
+                      corrupt_rate=0.0, locations=None, shard_records=100_000, seed=0):
+    root = Path(root)
+    rng = random.Random(seed)
+    locations = locations or max(1, practitioners // 10)
+    encounters = practitioners * encounters_per_practitioner
+    return {
+        "Location": _write_shards(root, "Location",
+                                  (location_record(rng, i) for i in range(locations)),
+                                  shard_records, corrupt_rate, rng),
+        "Practitioner": _write_shards(root, "Practitioner",
+                                      (practitioner_record(rng, i) for i in range(practitioners)),
+                                      shard_records, corrupt_rate, rng),
+        "Encounter": _write_shards(root, "Encounter",
+                                   (encounter_record(rng, i, practitioners, locations, participants)
+                                    for i in range(encounters)),
+                                   shard_records, corrupt_rate, rng)
+    }
+
+# Helper: A minimal Encounter with the given participants, period and location references
+def _edge_encounter(index, pids, start=None, end=None, loc_refs=()):
+    period = {key: value for key, value in (("start", start), ("end", end)) if value is not None}
+    return {
+        "resourceType": "Encounter",
+        "id": f"edge-{index}",
+        "participant": [{"individual": {"reference": pid}} for pid in pids],
+        "period": period,
+        "location": [{"location": {"reference": ref}} for ref in loc_refs]
+    }
+
+# Encounters exercising the first/last rules both engines must agree on, in file order,
+# split over two shards: ties (within and across files, also across UTC offsets and
+# fractional seconds), naive timestamps (taken as UTC), partial dates, missing
+# start/end, empty or whitespace location references and odd participant references
+_EDGE_ENCOUNTERS = [
+    (["Practitioner/tie"], "2020-01-01T05:00:00Z", "2020-01-01T05:00:00Z", ["Location/loc-0"]),
+    (["Practitioner/tie"], "2020-01-01T00:00:00-05:00", "2020-01-01T00:00:00-05:00", ["Location/loc-1"]),
+    (["Practitioner/partial"], "2021-03", "2021", ["loc-2"]),
+    (["Practitioner/partial"], "2021-03-01", "2021-01-01T00:00:00Z", [" LOCATION/LOC-3 "]),
+    (["Practitioner/missing"], "2019-06-01T12:00:00+02:00", None, ["", "Location/loc-4"]),
+    (["Practitioner/missing"], None, "2019-07-01", ["   "]),
+    (["Practitioner/undated"], None, None, ["Location/loc-0"]),
+    (["Practitioner/naive", "Practitioner/", "Patient/p-1"], "2018-05-05T10:00:00", "2018-05-05T10:00:00",
+     []),
+    # Second shard
+    (["Practitioner/tie"], "2020-01-01T06:00:00+01:00", "2020-01-01T05:00:00.000Z", ["Location/loc-5"]),
+    (["Practitioner/naive"], "2018-05-05T10:00:00Z", "2018-05-05T10:00:00+00:00", ["Location/loc-6"]),
+    (["Practitioner/partial"], "2021-03-01T00:00:00Z", "2021-01-01", ["Location/loc-2"]),
+    (["Practitioner/missing", "Practitioner/tie"], "2019-06-01T10:00:00Z", "2019-07-01T00:00:00Z",
+     ["Location/loc-7"])
+]
+
+# Write the fixed edge-case export under root (same layout as write_bulk_export)
+def write_edge_case_export(root):
+    root = Path(root)
+    rng = random.Random(0)
+    pids = ["tie", "partial", "missing", "undated", "naive", "inactive"]
+    encounters = [_edge_encounter(i, *fields) for i, fields in enumerate(_EDGE_ENCOUNTERS)]
+    return {
+        # loc-7 has no Location, so its address stays empty
+        "Location": _write_shards(root, "Location", (location_record(rng, i) for i in range(7)),
+                                  100, 0.0, rng),
+        "Practitioner": _write_shards(root, "Practitioner",
+                                      ({**practitioner_record(rng, i), "id": pid} for i, pid in enumerate(pids)),
+                                      100, 0.0, rng),
+        "Encounter": _write_shards(root, "Encounter", encounters, 8, 0.0, rng)
+    }
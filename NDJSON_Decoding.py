@@ -0,0 +1,48 @@
+import json
+from NDJSON_IO import open_lines
+from FHIR_Metrics import COUNTERS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+# Available JSON decoders by name; each takes one raw NDJSON line (bytes)
+DECODERS = {"json": json.loads}
+if orjson is not None:
+    DECODERS["orjson"] = orjson.loads
+if simdjson is not None:
+    DECODERS["simdjson"] = simdjson.loads
+
+# Fastest installed backend is the default; simdjson is opt-in only
+DEFAULT_BACKEND = "orjson" if "orjson" in DECODERS else "json"
+
+# Every backend reports bad input as ValueError (json.JSONDecodeError,
+# orjson.JSONDecodeError and UnicodeDecodeError all subclass it)
+DECODE_ERRORS = (ValueError,)
+
+# Helper: Look up a decoder by name (None = default backend)
+def get_decoder(backend=None):
+    backend = backend or DEFAULT_BACKEND
+    if backend not in DECODERS:
+        raise ValueError(
+            f"Unknown or unavailable JSON backend {backend!r}; choose from {sorted(DECODERS)}"
+        )
+    return DECODERS[backend]
+
+# Helper: Yield decoded records from an NDJSON file (path or PrefetchedFile), skipping corrupt lines
+def iter_ndjson(file, backend=None):
+    loads = get_decoder(backend)
+    for line in open_lines(file):
+        try:
+            rec = loads(line)
+        except DECODE_ERRORS:
+            COUNTERS["corrupt_lines"] += 1
+            print(f"⚠️ Skipping corrupt JSON in file: {file}")
+            continue
+        yield rec
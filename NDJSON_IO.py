@@ -0,0 +1,259 @@
+import bz2
+import gzip
+import mmap
+import os
+import queue
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import NamedTuple
+from FHIR_Metrics import COUNTERS, record_file_seconds
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Readahead for slow or on-demand storage (e.g. OneDrive "files on demand"):
+# a background thread opens, reads and decompresses the upcoming files in blocks
+# while the current one is being parsed, bounded by readahead_mb of buffered data.
+
+READ_BLOCK_SIZE = 8 * 2**20
+
+# Bulk Data exports may be compressed; the suffix picks the codec
+NDJSON_SUFFIXES = (".ndjson", ".ndjson.gz", ".ndjson.bz2", ".ndjson.zst")
+
+# Helper: All NDJSON shards (plain or compressed) under <resource_dir>/*/, sorted by path
+def find_ndjson_files(resource_dir):
+    return sorted(str(path) for suffix in NDJSON_SUFFIXES
+                  for path in Path(resource_dir).glob(f"*/*{suffix}"))
+
+# Helper: Fail up front if a shard needs a codec that is not installed, rather than when it
+# is first opened (on a reader thread or in a worker, after earlier stages have run)
+def check_codecs(files):
+    zst_files = [file for file in files if os.fspath(file).endswith(".zst")]
+    if zst_files and zstandard is None:
+        raise ImportError(f"Reading {len(zst_files)} .zst shard(s) (e.g. {zst_files[0]}) "
+                          "needs zstandard: pip install zstandard")
+
+# Helper: Open an NDJSON shard for binary reads, decompressing by suffix
+def open_ndjson(file):
+    name = os.fspath(file)
+    if name.endswith(".gz"):
+        return gzip.open(name, 'rb')
+    if name.endswith(".bz2"):
+        return bz2.open(name, 'rb')
+    if name.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError(f"Reading {name} needs zstandard: pip install zstandard")
+        return zstandard.open(name, 'rb')
+    return open(name, 'rb')
+
+# Helper: Read a binary stream in fixed-size blocks
+def iter_blocks(f):
+    while True:
+        block = f.read(READ_BLOCK_SIZE)
+        if not block:
+            return
+        yield block
+
+# A newline-aligned slice [start, stop) of an uncompressed NDJSON shard, so one
+# multi-GB file can be spread over several workers. Each worker memory-maps the
+# file and reads only its own range; the parent never reads the data.
+class ByteRange(NamedTuple):
+    path: str
+    start: int
+    stop: int
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return f"{self.path}[{self.start}:{self.stop}]"
+
+# Helper: Split uncompressed files larger than chunk_mb into newline-aligned ByteRanges
+# (in file order, so contiguous runs still reduce exactly like a serial scan).
+# Compressed files cannot be entered mid-stream and are kept whole; chunk_mb <= 0 disables
+def split_ndjson_files(files, chunk_mb):
+    chunk_bytes = int(chunk_mb * 2**20)
+    sources = []
+    for file in files:
+        size = os.path.getsize(file)
+        if chunk_bytes <= 0 or size <= chunk_bytes or not os.fspath(file).endswith(".ndjson"):
+            sources.append(file)
+            continue
+        with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                # End each range just past the first newline at or after the target size
+                newline = mm.find(b"\n", start + chunk_bytes - 1)
+                stop = size if newline == -1 else newline + 1
+                sources.append(ByteRange(os.fspath(file), start, stop))
+                start = stop
+    return sources
+
+# Helper: Size of a source as read from disk
+def source_size(file):
+    if isinstance(file, ByteRange):
+        return file.stop - file.start
+    return os.path.getsize(file)
+
+# Helper: Yield the raw (decompressed) blocks of a path or a ByteRange
+def iter_source_blocks(file):
+    if isinstance(file, ByteRange):
+        with open(file.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(file.start, file.stop, READ_BLOCK_SIZE):
+                yield mm[pos:min(pos + READ_BLOCK_SIZE, file.stop)]
+        return
+    with open_ndjson(file) as f:
+        yield from iter_blocks(f)
+
+# Helper: Split a stream of blocks into lines (bytes, without the newline)
+def iter_lines(blocks):
+    tail = b""
+    for block in blocks:
+        COUNTERS["bytes_read"] += len(block)
+        lines = (tail + block).split(b"\n")
+        tail = lines.pop()
+        COUNTERS["lines_read"] += len(lines)
+        yield from lines
+    if tail:
+        COUNTERS["lines_read"] += 1
+        yield tail
+
+# Throughput counters for one prefetching pass
+class ReadStats:
+    def __init__(self):
+        self.files = 0            # files (or ByteRanges) read
+        self.disk_bytes = 0       # bytes on disk (compressed size for .gz/.bz2/.zst)
+        self.bytes_read = 0       # bytes handed to the parser (after decompression)
+        self.read_seconds = 0.0   # time the reader thread spent opening, reading, decompressing
+        self.wait_seconds = 0.0   # time the parser sat blocked waiting for data
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def parse_seconds(self):
+        return max(0.0, self.elapsed - self.wait_seconds)
+
+    def summary(self):
+        mb = self.bytes_read / 2**20
+        rate = mb / self.elapsed if self.elapsed else 0.0
+        disk = (f" ({self.disk_bytes / 2**20:,.1f} MiB on disk)"
+                if self.disk_bytes != self.bytes_read else "")
+        return (f"📦 Read {mb:,.1f} MiB{disk} from {self.files} file(s) at {rate:,.1f} MiB/s: "
+                f"I/O {self.read_seconds:.1f}s (parser waited {self.wait_seconds:.1f}s), "
+                f"parse {self.parse_seconds:.1f}s")
+
+# One prefetched file; iterating it yields its lines as bytes (without the newline)
+class PrefetchedFile:
+    def __init__(self, path, prefetcher):
+        self.path = path
+        self._prefetcher = prefetcher
+        self._done = False
+
+    def __fspath__(self):
+        return os.fspath(self.path)
+
+    def __str__(self):
+        return str(self.path)
+
+    def blocks(self):
+        while not self._done:
+            block = self._prefetcher.next_block()
+            if block is None:
+                self._done = True
+                return
+            yield block
+
+    def __iter__(self):
+        return iter_lines(self.blocks())
+
+    # Skip whatever the consumer did not read, so the next file starts cleanly
+    def drain(self):
+        for _ in self.blocks():
+            pass
+
+class _Prefetcher:
+    def __init__(self, files, readahead_mb, stats):
+        self.files = files
+        self.stats = stats
+        self.queue = queue.Queue(maxsize=max(1, int(readahead_mb * 2**20 // READ_BLOCK_SIZE)))
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._read_all, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_all(self):
+        try:
+            for file in self.files:
+                self.stats.disk_bytes += source_size(file)
+                with closing(iter_source_blocks(file)) as blocks:
+                    while True:
+                        started = time.perf_counter()
+                        block = next(blocks, None)
+                        self.stats.read_seconds += time.perf_counter() - started
+                        if block is None:
+                            break
+                        self.stats.bytes_read += len(block)
+                        if not self._put(("block", block)):
+                            return
+                self.stats.files += 1
+                if not self._put(("end", None)):
+                    return
+        except Exception as e:
+            self._put(("error", e))
+
+    def next_block(self):
+        started = time.perf_counter()
+        kind, payload = self.queue.get()
+        self.stats.wait_seconds += time.perf_counter() - started
+        if kind == "error":
+            raise payload
+        return payload if kind == "block" else None
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+# Yield PrefetchedFile objects for files, in order, reading ahead in the background.
+# readahead_mb <= 0 yields the paths unchanged (plain reads). Either way, the time the
+# consumer spends on each file is recorded for the run report's slowest files
+def prefetch_files(files, readahead_mb, stats=None, report=True):
+    if readahead_mb <= 0:
+        for file in files:
+            started = time.perf_counter()
+            yield file
+            record_file_seconds(file, time.perf_counter() - started)
+        return
+
+    stats = stats or ReadStats()
+    prefetcher = _Prefetcher(list(files), readahead_mb, stats)
+    try:
+        for file in prefetcher.files:
+            started = time.perf_counter()
+            prefetched = PrefetchedFile(file, prefetcher)
+            yield prefetched
+            prefetched.drain()
+            record_file_seconds(file, time.perf_counter() - started)
+    finally:
+        prefetcher.close()
+        stats.elapsed = time.perf_counter() - stats.started
+    if report and stats.files:
+        print(stats.summary())
+
+# Helper: Iterate the lines of a path (plain or compressed), ByteRange or PrefetchedFile as bytes
+def open_lines(file):
+    if isinstance(file, PrefetchedFile):
+        yield from file
+        return
+    yield from iter_lines(iter_source_blocks(file))